@@ -1,137 +1,3309 @@
+import asyncio
 import base64
+import functools
+import hashlib
 import io
+import json
 import os
+import re
+import shutil
 import socket
-from typing import Dict, Optional, Any, List, Union
+import sqlite3
+import subprocess
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+import zlib
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, contextmanager
+from typing import Dict, Optional, Any, List, Tuple, Union
 from pathlib import Path
 
+import psutil
+import selenium.webdriver.chrome.webdriver
 import undetected_chromedriver as uc
-from fastapi import FastAPI, HTTPException, BackgroundTasks
-from fastapi.responses import JSONResponse
+import websockets
+from fastapi import FastAPI, HTTPException, BackgroundTasks, Header, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
 from pydantic import BaseModel, HttpUrl
+from selenium.common.exceptions import SessionNotCreatedException
+from selenium.webdriver.chromium.service import ChromiumService
+
+try:
+    import brotli
+except ImportError:  # optional, HTML responses fall back to gzip
+    brotli = None
+
+BASE_DIR = Path(os.path.dirname(os.path.abspath(__file__)))
 
 # Create profiles directory if it doesn't exist
-PROFILES_DIR = Path(os.path.dirname(os.path.abspath(__file__))) / "profiles"
+PROFILES_DIR = BASE_DIR / "profiles"
 PROFILES_DIR.mkdir(exist_ok=True)
 
+# Patched chromedriver binaries shared by every worker process (empty value disables the cache)
+DRIVER_CACHE_DIR = os.environ.get("UC_DRIVER_CACHE_DIR", str(BASE_DIR / "driver_cache"))
+
+# Sessions are recorded here so a restarted process can reattach to their browsers
+# (empty value disables it); with UC_PRESERVE_SESSIONS set, shutting down leaves
+# the browsers running for the next process instead of closing them
+SESSION_DB = os.environ.get("UC_SESSION_DB", str(BASE_DIR / "sessions.db"))
+PRESERVE_SESSIONS = os.environ.get("UC_PRESERVE_SESSIONS", "").lower() in ("1", "true", "yes")
+
+# Where tmpfs-backed throwaway profiles are created
+TMPFS_DIR = os.environ.get("UC_TMPFS_DIR", "/dev/shm")
+
+# Managed proxy pool: initial upstream proxies (comma-separated http://[user:pass@]host:port)
+# and when a proxy is taken out of rotation for a cooldown
+PROXY_LIST = os.environ.get("UC_PROXIES", "")
+PROXY_MAX_FAILURE_RATE = float(os.environ.get("UC_PROXY_MAX_FAILURE_RATE", "0.5"))
+PROXY_MAX_LATENCY = float(os.environ.get("UC_PROXY_MAX_LATENCY", "5"))
+PROXY_COOLDOWN = float(os.environ.get("UC_PROXY_COOLDOWN", "120"))
+PROXY_CONNECT_TIMEOUT = float(os.environ.get("UC_PROXY_CONNECT_TIMEOUT", "10"))
+
+# Scale-out: the router this worker registers with (empty when running standalone),
+# the URL the router should use to reach it, and how often it reports in
+ROUTER_URL = os.environ.get("UC_ROUTER_URL", "")
+WORKER_URL = os.environ.get("UC_WORKER_URL", "")
+HEARTBEAT_INTERVAL = float(os.environ.get("UC_HEARTBEAT_INTERVAL", "5"))
+
+# Browser pool sizing, overridable through the environment
+POOL_MIN_SIZE = int(os.environ.get("UC_POOL_MIN_SIZE", "0"))
+POOL_MAX_SIZE = int(os.environ.get("UC_POOL_MAX_SIZE", "4"))
+POOL_IDLE_TIMEOUT = float(os.environ.get("UC_POOL_IDLE_TIMEOUT", "600"))
+
+# Per-browser driver call queue: calls beyond the limit wait up to the timeout, then get a 503
+DRIVER_QUEUE_SIZE = int(os.environ.get("UC_DRIVER_QUEUE_SIZE", "16"))
+DRIVER_QUEUE_TIMEOUT = float(os.environ.get("UC_DRIVER_QUEUE_TIMEOUT", "60"))
+
+# Reaper: how often leftover Chrome/chromedriver processes are looked for (0 disables it)
+# and how long a closed session's processes get to exit before they are killed
+REAPER_INTERVAL = float(os.environ.get("UC_REAPER_INTERVAL", "30"))
+REAPER_GRACE = float(os.environ.get("UC_REAPER_GRACE", "10"))
+
+# Supervisor: resource sampling interval and recycling thresholds (0 disables a threshold)
+SUPERVISOR_INTERVAL = float(os.environ.get("UC_SUPERVISOR_INTERVAL", "15"))
+RECYCLE_MAX_RSS_MB = float(os.environ.get("UC_RECYCLE_MAX_RSS_MB", "0"))
+RECYCLE_MAX_NAVIGATIONS = int(os.environ.get("UC_RECYCLE_MAX_NAVIGATIONS", "0"))
+RECYCLE_MAX_AGE = float(os.environ.get("UC_RECYCLE_MAX_AGE", "0"))
+
+# Calls allowed to wait for (or hold) one session before new ones are refused with 429
+SESSION_QUEUE_DEPTH = int(os.environ.get("UC_SESSION_QUEUE_DEPTH", "8"))
+
+# Background jobs: number of jobs run at once and how long finished jobs stay queryable
+JOB_WORKERS = int(os.environ.get("UC_JOB_WORKERS", str(POOL_MAX_SIZE)))
+JOB_RETENTION = float(os.environ.get("UC_JOB_RETENTION", "3600"))
+
+# How far ahead of the slowest unfinished URL an input-ordered batch stream may fetch
+BATCH_REORDER_WINDOW = int(os.environ.get("UC_BATCH_REORDER_WINDOW", "32"))
+
+# Rendered-result cache for batch and extract fetches (a TTL of 0 disables it)
+RENDER_CACHE_TTL = float(os.environ.get("UC_RENDER_CACHE_TTL", "0"))
+RENDER_CACHE_MAX_MB = float(os.environ.get("UC_RENDER_CACHE_MAX_MB", "256"))
+
 # Models for request and response
+class BlockRules(BaseModel):
+    resource_types: List[str] = []  # any of "image", "font", "media", "stylesheet"
+    url_patterns: List[str] = []  # URL globs, "*" matches anything
+    trackers: bool = False  # block the bundled list of ad and analytics hosts
+
+class WaitConditions(BaseModel):
+    dom_content_loaded: bool = False
+    selector: Optional[str] = None  # CSS selector that must be present
+    network_idle_ms: Optional[int] = None  # no new resources loaded for this long
+    js: Optional[str] = None  # JavaScript expression that must become truthy
+
 class NavigateRequest(BaseModel):
     url: HttpUrl
     timeout: int = 30
+    session_id: Optional[str] = None
+    block: Optional[BlockRules] = None  # overrides the session's rules for this navigation
+    page_load_strategy: str = "normal"  # "normal" waits for load, "eager" for DOMContentLoaded, "none" for nothing
+    wait: Optional[WaitConditions] = None
+    tab_id: Optional[str] = None  # a tab opened with /browser/tabs instead of the main window
+
+class TabRequest(BaseModel):
+    session_id: Optional[str] = None
+    url: Optional[HttpUrl] = None
+    timeout: int = 30
+    page_load_strategy: str = "normal"
+    wait: Optional[WaitConditions] = None
 
 class StartBrowserRequest(BaseModel):
     url: HttpUrl  # URL is required for browser start
     proxy: Optional[str] = None
     headless: bool = False
-    profile_name: Optional[str] = "default"
+    profile_name: Optional[str] = "default"  # None for a throwaway profile, removed when the browser closes
+    template: Optional[str] = None  # start from a throwaway copy of this profile instead
+    tmpfs: bool = False  # keep a throwaway profile in memory (UC_TMPFS_DIR)
+    block: Optional[BlockRules] = None
+
+class JavascriptRequest(BaseModel):
+    script: str
+    timeout: int = 30
+    session_id: Optional[str] = None
+    await_promise: bool = False  # wait for a returned promise and return what it resolves to
+    tab_id: Optional[str] = None
+
+class JavascriptBatchRequest(BaseModel):
+    scripts: List[str]  # expressions; a function expression is called with no arguments
+    timeout: int = 30
+    session_id: Optional[str] = None
+    await_promise: bool = False
+
+class BatchFetchRequest(BaseModel):
+    urls: List[HttpUrl]
+    extract: List[str] = ["title"]  # any of "title", "html", "js", "screenshot"
+    script: Optional[str] = None  # JavaScript expression evaluated when extract contains "js"
+    concurrency: int = 2
+    timeout: int = 30
+    order: str = "input"  # "input" or "completion"
+    session_ids: Optional[List[str]] = None  # reuse these sessions instead of launching new ones
+    headless: bool = True
+    proxy: Optional[str] = None
+    template: Optional[str] = None  # profile the batch's browsers are cloned from
+    tmpfs: bool = False
+    block: Optional[BlockRules] = None
+    page_load_strategy: str = "normal"
+    wait: Optional[WaitConditions] = None
+
+class JobRequest(BaseModel):
+    type: str  # "navigate", "javascript" or "extract"
+    session_id: Optional[str] = None  # extract jobs without one run on a throwaway session
+    url: Optional[HttpUrl] = None
+    script: Optional[str] = None
+    extract: List[str] = ["title"]
+    timeout: int = 30
+    priority: int = 0  # higher runs first
+    deadline: Optional[float] = None  # seconds after submission before the job is abandoned
+    webhook_url: Optional[HttpUrl] = None
+
+class WarmPoolRequest(BaseModel):
+    profile_name: str = "default"
+    headless: bool = False
+    proxy: Optional[str] = None
+    size: int = 1
+
+class CdpRequest(BaseModel):
+    method: str  # e.g. "Network.getResponseBody"
+    params: Dict[str, Any] = {}
+    session_id: Optional[str] = None
+
+class ScriptRequest(BaseModel):
+    source: str  # a JavaScript function expression, e.g. "function (selector) { ... }"
+    name: Optional[str] = None
+
+class ScriptCallRequest(BaseModel):
+    args: List[Any] = []
+    session_id: Optional[str] = None
+    timeout: int = 30
+
+class ProfileListResponse(BaseModel):
+    profiles: List[str]
+
+class ProxyConfig(BaseModel):
+    server: str
+    username: Optional[str] = None
+    password: Optional[str] = None
+
+class ProxyPoolRequest(BaseModel):
+    proxies: List[ProxyConfig]
+
+class ApiResponse(BaseModel):
+    success: bool
+    data: Optional[Any] = None
+    error: Optional[str] = None
+
+# Resource blocking: Chrome's own resource types, failed through Fetch interception
+RESOURCE_TYPES = {"image": "Image", "font": "Font", "media": "Media", "stylesheet": "Stylesheet"}
+
+TRACKER_HOSTS = (
+    "google-analytics.com", "googletagmanager.com", "googletagservices.com", "doubleclick.net",
+    "googlesyndication.com", "googleadservices.com", "adservice.google.com", "connect.facebook.net",
+    "facebook.com/tr", "analytics.tiktok.com", "ads-twitter.com", "static.ads-twitter.com",
+    "bat.bing.com", "clarity.ms", "hotjar.com", "segment.io", "cdn.segment.com", "mixpanel.com",
+    "amplitude.com", "heap.io", "fullstory.com", "mouseflow.com", "crazyegg.com", "quantserve.com",
+    "scorecardresearch.com", "adnxs.com", "criteo.com", "criteo.net", "taboola.com", "outbrain.com",
+    "amazon-adsystem.com", "pubmatic.com", "rubiconproject.com", "openx.net", "casalemedia.com",
+    "moatads.com", "adsrvr.org", "yieldmo.com", "sharethrough.com", "nr-data.net", "newrelic.com",
+    "optimizely.com", "chartbeat.com", "parsely.com", "snap.licdn.com", "px.ads.linkedin.com",
+)
+
+PAGE_LOAD_STRATEGIES = ("normal", "eager", "none")
+WAIT_POLL_INTERVAL = 0.05
+
+def validate_page_load_strategy(strategy: str) -> None:
+    if strategy not in PAGE_LOAD_STRATEGIES:
+        raise HTTPException(status_code=422, detail=f"page_load_strategy must be one of: {', '.join(PAGE_LOAD_STRATEGIES)}")
+
+def wait_script(wait: WaitConditions, ready_state: Optional[str] = None, time_origin: Any = None) -> str:
+    """
+    Function body returning [conditions met, resources loaded so far] for the
+    current page. ready_state "complete" also waits for the load event, and
+    time_origin (the previous document's) for that document to be replaced.
+    """
+    checks = []
+    if time_origin is not None:
+        checks.append(f"performance.timeOrigin !== {json.dumps(time_origin)}")
+    if ready_state == "complete":
+        checks.append("document.readyState === 'complete'")
+    if wait.dom_content_loaded:
+        checks.append("document.readyState !== 'loading'")
+    if wait.selector:
+        checks.append(f"document.querySelector({json.dumps(wait.selector)}) !== null")
+    if wait.js:
+        checks.append(f"!!(function () {{ return ({wait.js}); }})()")
+    return (
+        "var ready = " + (" && ".join(f"({check})" for check in checks) or "true") + ";"
+        "return [ready, performance.getEntriesByType('resource').length];"
+    )
+
+def block_patterns(rules: Optional[BlockRules]) -> List[str]:
+    """Turn URL and tracker rules into Network.setBlockedURLs patterns"""
+    if rules is None:
+        return []
+    unknown = [t for t in rules.resource_types if t not in RESOURCE_TYPES]
+    if unknown:
+        raise HTTPException(status_code=422, detail=f"Unknown resource type(s): {', '.join(unknown)}")
+    patterns: List[str] = list(rules.url_patterns)
+    if rules.trackers:
+        for host in TRACKER_HOSTS:
+            patterns.append(f"*://{host}*")
+            patterns.append(f"*://*.{host}*")
+    return sorted(set(patterns))
+
+def block_types(rules: Optional[BlockRules]) -> List[str]:
+    """CDP resource types to fail before they are requested (validated by block_patterns)"""
+    if rules is None:
+        return []
+    return sorted({RESOURCE_TYPES[t] for t in rules.resource_types if t in RESOURCE_TYPES})
+
+# Prometheus metrics
+def _escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(labels: Tuple[Tuple[str, str], ...]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape_label(value)}"' for name, value in labels) + "}"
+
+class Counter:
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help = help_text
+        self.values: Dict[Tuple[Tuple[str, str], ...], float] = {}
+        self._lock = threading.Lock()
+    
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = tuple(sorted((k, str(v)) for k, v in labels.items()))
+        with self._lock:
+            self.values[key] = self.values.get(key, 0.0) + amount
+    
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self.values.items()):
+                lines.append(f"{self.name}{_format_labels(key)} {value}")
+        return lines
+
+class Histogram:
+    DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+    
+    def __init__(self, name: str, help_text: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(sorted(buckets))
+        self.values: Dict[Tuple[Tuple[str, str], ...], List[float]] = {}  # bucket counts + [sum, count]
+        self._lock = threading.Lock()
+    
+    def observe(self, value: float, **labels) -> None:
+        key = tuple(sorted((k, str(v)) for k, v in labels.items()))
+        with self._lock:
+            series = self.values.setdefault(key, [0.0] * (len(self.buckets) + 2))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+    
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self.values.items()):
+                for bound, count in zip(self.buckets, series):
+                    lines.append(f"{self.name}_bucket{_format_labels(key + (('le', repr(bound)),))} {count}")
+                lines.append(f"{self.name}_bucket{_format_labels(key + (('le', '+Inf'),))} {series[-1]}")
+                lines.append(f"{self.name}_sum{_format_labels(key)} {series[-2]}")
+                lines.append(f"{self.name}_count{_format_labels(key)} {series[-1]}")
+        return lines
+
+def _gauge(name: str, help_text: str, samples: List[Tuple[Dict[str, Any], float]], kind: str = "gauge") -> List[str]:
+    """Render values read at scrape time (kind="counter" for totals kept elsewhere)"""
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+    for labels, value in samples:
+        lines.append(f"{name}{_format_labels(tuple(sorted((k, str(v)) for k, v in labels.items())))} {value}")
+    return lines
+
+class Metrics:
+    """
+    Minimal Prometheus text exposition: per-phase latency histograms and error
+    counters filled in by the browser controllers, plus gauges collected from
+    the pool, the job queue and the Chrome processes when /metrics is scraped.
+    """
+    def __init__(self):
+        self.phase_seconds = Histogram("uc_phase_seconds", "Time spent in each browser phase (launch, navigate, script, page_source, screenshot)")
+        self.errors = Counter("uc_errors_total", "Errors raised by browser phases, by exception type")
+        self.recycles = Counter("uc_recycles_total", "Browsers restarted by the supervisor, by reason")
+        self.leaks = Counter("uc_leaked_processes_total", "Chrome and chromedriver processes killed by the reaper, by reason")
+        # Compare the blocking="on" and blocking="off" series to see what blocking saves
+        self.page_load_seconds = Histogram("uc_page_load_seconds", "Time until navigation returned, by page load strategy and whether resource blocking was active")
+        self.page_bytes = Histogram(
+            "uc_page_bytes", "Bytes transferred per page load (Resource Timing) by whether resource blocking was active",
+            buckets=(50e3, 100e3, 250e3, 500e3, 1e6, 2.5e6, 5e6, 10e6, 25e6),
+        )
+    
+    def render(self, rss: Optional[Dict[str, int]] = None) -> str:
+        """Exposition text; rss maps session IDs to Chrome memory, read off the event loop by the caller"""
+        rss = rss or {}
+        lines = self.phase_seconds.render() + self.errors.render() + self.recycles.render() + self.leaks.render()
+        lines += self.page_load_seconds.render() + self.page_bytes.render()
+        sessions = list(pool.sessions.values())
+        lines += _gauge("uc_pool_sessions", "Browser sessions in the pool", [({}, len(sessions))])
+        lines += _gauge("uc_pool_max_sessions", "Configured maximum number of sessions", [({}, pool.max_size)])
+        lines += _gauge("uc_pool_launching", "Sessions currently being launched", [({}, pool._launching)])
+        lines += _gauge("uc_pool_busy_sessions", "Sessions with at least one call in flight", [({}, sum(1 for s in sessions if s.in_flight))])
+        lines += _gauge("uc_warm_standby", "Launched browsers waiting on standby", [({}, sum(len(v) for v in pool.warm.values()))])
+        lines += _gauge("uc_session_queue_depth", "API calls holding or waiting for a session", [
+            ({"session": s.session_id, "profile": s.metric_labels()["profile"]}, s.pending) for s in sessions
+        ])
+        lines += _gauge("uc_jobs", "Background jobs by status", [
+            ({"status": status}, sum(1 for j in jobs.jobs.values() if j.status == status))
+            for status in ("queued", "running")
+        ])
+        lines += _gauge("uc_chrome_rss_bytes", "Resident memory of each session's Chrome process tree", [
+            ({"session": s.session_id, "profile": s.metric_labels()["profile"]}, rss[s.session_id])
+            for s in sessions if rss.get(s.session_id) is not None
+        ])
+        lines += _gauge("uc_chrome_cpu_percent", "CPU use of each session's Chrome process tree at the last supervisor sample", [
+            ({"session": s.session_id, "profile": s.metric_labels()["profile"]}, s.resources["cpu_percent"])
+            for s in sessions if s.resources
+        ])
+        lines += _gauge("uc_warm_claims_total", "Warm standby claims by outcome", [
+            ({"outcome": "hit"}, pool.warm_hits), ({"outcome": "miss"}, pool.warm_misses)
+        ], kind="counter")
+        lines += _gauge("uc_driver_cache_lookups_total", "Patched driver cache lookups by outcome", [
+            ({"outcome": "hit"}, driver_cache.hits), ({"outcome": "miss"}, driver_cache.misses)
+        ], kind="counter")
+        lines += _gauge("uc_render_cache_lookups_total", "Rendered-result cache lookups by outcome", [
+            ({"outcome": outcome}, count) for outcome, count in render_cache.lookups.items()
+        ], kind="counter")
+        lines += _gauge("uc_proxy_healthy", "Whether each pool proxy is in rotation", [
+            ({"proxy": p.server}, int(p.healthy)) for p in proxy_pool.proxies.values()
+        ])
+        lines += _gauge("uc_proxy_latency_seconds", "Moving average of the time to open a tunnel through each pool proxy", [
+            ({"proxy": p.server}, p.latency) for p in proxy_pool.proxies.values() if p.latency is not None
+        ])
+        lines += _gauge("uc_proxy_connections_total", "Connections through each pool proxy by outcome", [
+            ({"proxy": p.server, "outcome": outcome}, count) for p in proxy_pool.proxies.values()
+            for outcome, count in (("ok", p.connections - p.failures), ("failed", p.failures))
+        ], kind="counter")
+        lines += _gauge("uc_render_cache_bytes", "Approximate size of the rendered-result cache", [({}, render_cache.size)])
+        return "\n".join(lines) + "\n"
+
+metrics = Metrics()
+
+def process_tree(pid: Optional[int]) -> List[psutil.Process]:
+    """A process and all its descendants, skipping ones that have already exited"""
+    if not pid:
+        return []
+    try:
+        root = psutil.Process(pid)
+        return [root] + root.children(recursive=True)
+    except psutil.Error:
+        return []
+
+@contextmanager
+def _file_lock(path: Path):
+    """Exclusive lock on a file, held across processes"""
+    with open(path, "a+b") as fh:
+        if os.name == "nt":
+            import msvcrt
+            while True:
+                try:
+                    fh.seek(0)
+                    msvcrt.locking(fh.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    time.sleep(0.1)
+            try:
+                yield
+            finally:
+                fh.seek(0)
+                msvcrt.locking(fh.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(fh.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(fh.fileno(), fcntl.LOCK_UN)
+
+# Throwaway profiles
+EPHEMERAL_PREFIX = "uc-profile-"
+# Caches and lock files that a cloned profile doesn't need (and mustn't inherit)
+PROFILE_CLONE_IGNORE = shutil.ignore_patterns(
+    "Cache", "Code Cache", "GPUCache", "GrShaderCache", "ShaderCache", "DawnCache", "DawnGraphiteCache",
+    "DawnWebGPUCache", "CacheStorage", "Crashpad", "BrowserMetrics*", "Singleton*", "lockfile", "*.tmp",
+)
+FICLONE = 0x40049409  # Linux ioctl that shares a file's blocks copy-on-write (btrfs, XFS)
+
+def _clone_file(src: str, dst: str) -> str:
+    """Copy a file, as a copy-on-write clone where the filesystem supports it"""
+    if os.name != "nt":
+        import fcntl
+        try:
+            with open(src, "rb") as source, open(dst, "wb") as target:
+                fcntl.ioctl(target.fileno(), FICLONE, source.fileno())
+            shutil.copystat(src, dst)
+            return dst
+        except OSError:
+            pass
+    return shutil.copy2(src, dst)
+
+def make_ephemeral_profile(template: Optional[str] = None, tmpfs: bool = False) -> str:
+    """
+    Create a throwaway user data dir, optionally on tmpfs and optionally as a
+    copy of a profile in PROFILES_DIR. The process ID in the name lets
+    sweep_ephemeral_profiles() tell which ones were left behind.
+    """
+    if tmpfs and not os.path.isdir(TMPFS_DIR):
+        raise HTTPException(status_code=400, detail=f"tmpfs directory '{TMPFS_DIR}' is not available")
+    if template is not None and not (PROFILES_DIR / template).is_dir():
+        raise HTTPException(status_code=404, detail=f"Profile template '{template}' not found")
+    path = tempfile.mkdtemp(prefix=f"{EPHEMERAL_PREFIX}{os.getpid()}-", dir=TMPFS_DIR if tmpfs else None)
+    if template is not None:
+        try:
+            shutil.copytree(PROFILES_DIR / template, path, symlinks=True, ignore=PROFILE_CLONE_IGNORE,
+                            copy_function=_clone_file, dirs_exist_ok=True)
+        except Exception:
+            shutil.rmtree(path, ignore_errors=True)
+            raise
+    return path
+
+def sweep_ephemeral_profiles(keep: Optional[set] = None) -> int:
+    """
+    Remove throwaway profiles left behind by processes that no longer exist,
+    except the ones in keep (still in use by a browser that was reattached)
+    """
+    keep = keep or set()
+    removed = 0
+    for parent in {tempfile.gettempdir(), TMPFS_DIR}:
+        try:
+            entries = os.listdir(parent)
+        except OSError:
+            continue
+        for name in entries:
+            if not name.startswith(EPHEMERAL_PREFIX):
+                continue
+            pid = name[len(EPHEMERAL_PREFIX):].split("-", 1)[0]
+            path = os.path.join(parent, name)
+            if pid.isdigit() and not psutil.pid_exists(int(pid)) and path not in keep:
+                shutil.rmtree(path, ignore_errors=True)
+                removed += 1
+    return removed
+
+# Patched chromedriver cache
+class DriverCache:
+    """
+    Content-addressed store of patched chromedriver binaries, keyed by Chrome
+    major version. The first launch for a version lets undetected-chromedriver
+    download and patch the driver, then copies it into the cache under its
+    SHA-256; later launches (in this or any other worker process) pass the
+    cached binary as driver_executable_path so no patching happens.
+    """
+    def __init__(self, root: Optional[str]):
+        self.root = Path(root) if root else None
+        self.hits = 0
+        self.misses = 0
+        self.patch_seconds = 0.0
+        self.launches: Dict[str, int] = {}
+        self.launch_seconds: Dict[str, float] = {}
+        self._major: Optional[int] = None
+        self._binary: Optional[Tuple[str, float]] = None  # (path, mtime) of the Chrome binary _major was read from
+        self._paths: Dict[int, str] = {}
+        self._lock = threading.Lock()
+    
+    def chrome_major_version(self) -> Optional[int]:
+        """
+        Detect the installed Chrome major version, or None if it can't be found.
+        It is read again whenever the Chrome binary changes, e.g. after an update.
+        """
+        binary = uc.find_chrome_executable()
+        if not binary:
+            return None
+        try:
+            real = os.path.realpath(binary)
+            stamp = (real, os.stat(real).st_mtime)
+        except OSError:
+            return None
+        if self._major is None or self._binary != stamp:
+            try:
+                output = subprocess.run([binary, "--version"], capture_output=True, text=True, timeout=15).stdout
+            except (OSError, subprocess.SubprocessError):
+                return None
+            match = re.search(r"(\d+)\.\d+", output)
+            if not match:
+                return None
+            self._major, self._binary = int(match.group(1)), stamp
+        return self._major
+    
+    def invalidate(self) -> None:
+        """Forget the detected Chrome version, after a cached driver was refused"""
+        self._major = None
+        self._binary = None
+    
+    def _read_index(self) -> Dict[str, str]:
+        try:
+            return json.loads((self.root / "index.json").read_text())
+        except (OSError, ValueError):
+            return {}
+    
+    def _write_index(self, index: Dict[str, str]) -> None:
+        tmp = self.root / f"index.json.{os.getpid()}"
+        tmp.write_text(json.dumps(index, indent=2))
+        os.replace(tmp, self.root / "index.json")
+    
+    def get(self) -> Tuple[Optional[str], Optional[int], str]:
+        """
+        Return (driver path, Chrome major version, status) where status is
+        "hit", "miss" or "disabled". On "disabled" the caller should let
+        undetected-chromedriver manage the driver itself.
+        """
+        if self.root is None:
+            return None, None, "disabled"
+        major = self.chrome_major_version()
+        if major is None:
+            return None, None, "disabled"
+        
+        with self._lock:
+            path = self._paths.get(major)
+            if path and os.path.exists(path):
+                self.hits += 1
+                return path, major, "hit"
+            
+            self.root.mkdir(parents=True, exist_ok=True)
+            with _file_lock(self.root / ".lock"):
+                index = self._read_index()
+                digest = index.get(str(major))
+                if digest and (self.root / digest).exists():
+                    status = "hit"
+                    self.hits += 1
+                else:
+                    status = "miss"
+                    self.misses += 1
+                    started = time.perf_counter()
+                    patcher = uc.Patcher(version_main=major)
+                    patcher.auto()
+                    with open(patcher.executable_path, "rb") as fh:
+                        data = fh.read()
+                    digest = hashlib.sha256(data).hexdigest() + (".exe" if os.name == "nt" else "")
+                    target = self.root / digest
+                    if not target.exists():
+                        tmp = self.root / f"{digest}.{os.getpid()}.part"
+                        tmp.write_bytes(data)
+                        os.chmod(tmp, 0o755)
+                        os.replace(tmp, target)
+                    index[str(major)] = digest
+                    self._write_index(index)
+                    self.patch_seconds += time.perf_counter() - started
+            path = str(self.root / digest)
+            self._paths[major] = path
+            return path, major, status
+    
+    def record_launch(self, status: str, seconds: float) -> None:
+        with self._lock:
+            self.launches[status] = self.launches.get(status, 0) + 1
+            self.launch_seconds[status] = self.launch_seconds.get(status, 0.0) + seconds
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "directory": str(self.root) if self.root else None,
+            "chrome_major_version": self._major,
+            "hits": self.hits,
+            "misses": self.misses,
+            "patch_seconds": round(self.patch_seconds, 3),
+            "launches": {
+                status: {
+                    "count": count,
+                    "avg_seconds": round(self.launch_seconds[status] / count, 3),
+                }
+                for status, count in self.launches.items()
+            },
+        }
+
+driver_cache = DriverCache(DRIVER_CACHE_DIR)
+
+# Reattaching to browsers across restarts
+class ReattachedChrome(uc.Chrome):
+    """
+    A uc.Chrome for a browser that is already running, left behind by an
+    earlier process. A fresh chromedriver attaches to it through its DevTools
+    address instead of launching Chrome, and quit() still ends the browser.
+    """
+    def __init__(self, debugger_address: str, browser_pid: int, driver_executable_path: str, headless: bool = False):
+        self.debug = False  # read by uc.Chrome.__getattribute__ on every access
+        self.browser_pid = browser_pid
+        self.keep_user_data_dir = True
+        self.patcher = None
+        self.reactor = None
+        options = uc.ChromeOptions()
+        options.debugger_address = debugger_address
+        options.page_load_strategy = "none"
+        selenium.webdriver.chrome.webdriver.WebDriver.__init__(
+            self, service=ChromiumService(driver_executable_path), options=options
+        )
+        if headless:
+            self._configure_headless()
+
+def surviving_chrome(pid: Optional[int], profile_dir: Optional[str]) -> Optional[psutil.Process]:
+    """The Chrome process with this PID if it is still running on this profile (PIDs get reused)"""
+    if not pid or not profile_dir:
+        return None
+    try:
+        proc = psutil.Process(pid)
+        if f"--user-data-dir={profile_dir}" in proc.cmdline():
+            return proc
+    except psutil.Error:
+        pass
+    return None
+
+def reap_browser(record: Dict[str, Any]) -> None:
+    """Kill what is left of a recorded session's Chrome and chromedriver and remove its throwaway profile"""
+    if surviving_chrome(record["browser_pid"], record["profile_dir"]):
+        for proc in reversed(process_tree(record["browser_pid"])):
+            try:
+                proc.kill()
+            except psutil.Error:
+                pass
+    if record["driver_pid"] and record["driver_port"]:
+        try:
+            proc = psutil.Process(record["driver_pid"])
+            if f"--port={record['driver_port']}" in proc.cmdline():
+                proc.kill()
+        except psutil.Error:
+            pass
+    if record["ephemeral"]:
+        shutil.rmtree(record["profile_dir"], ignore_errors=True)
+
+class SessionRegistry:
+    """
+    Sessions recorded in SQLite along with what it takes to find their
+    browser again: profile, launch options, DevTools address and the Chrome
+    and chromedriver PIDs. On startup BrowserPool.restore() reattaches to the
+    browsers that outlived the previous process and reaps the rest. Rows are
+    scoped to WORKER_URL, so workers sharing a directory don't touch each
+    other's sessions. Writes run in order on a thread of their own, since
+    SQLite may block for up to its busy timeout while another worker writes.
+    """
+    COLUMNS = ("session_id", "worker", "owner_pid", "profile", "profile_dir", "ephemeral", "template", "tmpfs",
+               "headless", "proxy", "block", "debugger_address", "browser_pid", "driver_pid", "driver_port", "created_at")
+    
+    def __init__(self, path: Optional[str]):
+        self.path = path or None
+        self._db: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="session-db")
+    
+    @property
+    def enabled(self) -> bool:
+        return self.path is not None
+    
+    def _connect(self) -> sqlite3.Connection:
+        if self._db is None:
+            self._db = sqlite3.connect(self.path, timeout=10, isolation_level=None, check_same_thread=False)
+            self._db.row_factory = sqlite3.Row
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS sessions (session_id TEXT PRIMARY KEY, worker TEXT NOT NULL, owner_pid INTEGER, "
+                "profile TEXT, profile_dir TEXT, ephemeral INTEGER, template TEXT, tmpfs INTEGER, headless INTEGER, "
+                "proxy TEXT, block TEXT, debugger_address TEXT, browser_pid INTEGER, driver_pid INTEGER, "
+                "driver_port INTEGER, created_at REAL)"
+            )
+        return self._db
+    
+    def _execute(self, sql: str, params: Tuple[Any, ...]) -> None:
+        with self._lock:
+            self._connect().execute(sql, params)
+    
+    async def _write(self, sql: str, params: Tuple[Any, ...]) -> None:
+        loop = asyncio.get_event_loop()
+        await loop.run_in_executor(self._executor, self._execute, sql, params)
+    
+    async def save(self, session: "BrowserController") -> None:
+        """Record a running session, replacing what was recorded for it before"""
+        driver = session.driver
+        if not self.enabled or driver is None:
+            return
+        process = getattr(getattr(driver, "service", None), "process", None)
+        row = (
+            session.session_id, WORKER_URL, os.getpid(), session.current_profile,
+            session.user_data_dir or str(PROFILES_DIR / session.current_profile), session.user_data_dir is not None,
+            session.template, session.tmpfs, session.headless, session.proxy,
+            json.dumps(session.block_rules.dict()) if session.block_rules else None, session.debugger_address,
+            getattr(driver, "browser_pid", None), getattr(process, "pid", None),
+            getattr(getattr(driver, "service", None), "port", None), session.created_at,
+        )
+        await self._write(
+            f"INSERT OR REPLACE INTO sessions ({', '.join(self.COLUMNS)}) VALUES ({', '.join('?' * len(self.COLUMNS))})", row
+        )
+    
+    async def remove(self, session_id: str) -> None:
+        if not self.enabled:
+            return
+        await self._write("DELETE FROM sessions WHERE session_id = ? AND worker = ?", (session_id, WORKER_URL))
+    
+    def orphaned(self) -> List[Dict[str, Any]]:
+        """This worker's sessions whose process has exited, oldest first"""
+        if not self.enabled:
+            return []
+        with self._lock:
+            rows = self._connect().execute(
+                "SELECT * FROM sessions WHERE worker = ? ORDER BY created_at", (WORKER_URL,)
+            ).fetchall()
+        return [dict(row) for row in rows if row["owner_pid"] == os.getpid() or not psutil.pid_exists(row["owner_pid"])]
+    
+    def ephemeral_dirs(self) -> set:
+        """Throwaway profiles of every recorded session, across all workers"""
+        if not self.enabled:
+            return set()
+        with self._lock:
+            rows = self._connect().execute("SELECT profile_dir FROM sessions WHERE ephemeral").fetchall()
+        return {row["profile_dir"] for row in rows}
+
+session_registry = SessionRegistry(SESSION_DB)
+
+class ProcessReaper:
+    """
+    Makes sure browser processes don't outlive their sessions. close_browser()
+    hands over a snapshot of the session's process tree, and whatever is still
+    running after the grace period is killed. Each sweep also kills processes
+    that dropped out of a live session's tree (their Chrome parent crashed),
+    Chrome and chromedriver processes under this one that no session owns,
+    and waits for exited children so they don't linger as zombies. Every kill
+    is recorded as a leak.
+    """
+    def __init__(self, interval: float = 30.0, grace: float = 10.0):
+        self.interval = interval
+        self.grace = grace
+        self.launching = 0  # browser launches in progress, whose processes have no owner yet
+        self.killed: Dict[str, int] = {}
+        self.zombies = 0
+        self.profiles_removed = 0
+        self.leaks: deque = deque(maxlen=100)
+        self.last_sweep: Optional[float] = None
+        self._pending: List[Tuple[float, str, List[psutil.Process]]] = []  # (deadline, session ID, processes)
+        self._trees: Dict[str, Dict[int, psutil.Process]] = {}  # live session ID -> processes seen at the last sweep
+        self._dirs: set = set()  # throwaway profiles that couldn't be removed yet
+        self._lock = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+    
+    def expect_exit(self, session_id: str, procs: List[psutil.Process]) -> None:
+        """Kill these processes if they are still running once the grace period is over"""
+        if procs:
+            with self._lock:
+                self._pending.append((time.monotonic() + self.grace, session_id, procs))
+    
+    def remove_later(self, path: str) -> None:
+        """Retry removing a throwaway profile that was still in use"""
+        with self._lock:
+            self._dirs.add(path)
+    
+    def _kill(self, proc: psutil.Process, session_id: Optional[str], reason: str) -> None:
+        try:
+            if proc.status() == psutil.STATUS_ZOMBIE:
+                return
+            leak = {
+                "pid": proc.pid,
+                "name": proc.name(),
+                "session_id": session_id,
+                "reason": reason,
+                "rss_bytes": proc.memory_info().rss,
+                "age_seconds": round(time.time() - proc.create_time(), 1),
+                "found_at": time.time(),
+            }
+            proc.kill()
+        except psutil.Error:
+            return
+        self.leaks.append(leak)
+        self.killed[reason] = self.killed.get(reason, 0) + 1
+        metrics.leaks.inc(reason=reason)
+    
+    def sweep(self, sessions: Dict[str, List[int]]) -> None:
+        """One pass over the processes (blocking); sessions maps live session IDs to their root PIDs"""
+        now = time.monotonic()
+        with self._lock:
+            due = [p for p in self._pending if p[0] <= now]
+            self._pending = [p for p in self._pending if p[0] > now]
+            waiting = {proc.pid for _, _, procs in self._pending + due for proc in procs}
+            dirs = set(self._dirs)
+        
+        for _, session_id, procs in due:
+            for proc in procs:
+                if proc.is_running():
+                    self._kill(proc, session_id, "outlived session")
+        
+        owned = set(waiting)
+        trees = {}
+        for session_id, roots in sessions.items():
+            tree = {proc.pid: proc for pid in roots for proc in process_tree(pid)}
+            for pid, proc in self._trees.get(session_id, {}).items():
+                if pid not in tree and pid not in waiting and proc.is_running():
+                    self._kill(proc, session_id, "detached from session")
+            trees[session_id] = tree
+            owned.update(tree)
+        self._trees = trees
+        
+        me = psutil.Process()
+        for child in me.children(recursive=True):
+            try:
+                if child.status() == psutil.STATUS_ZOMBIE:
+                    if child.ppid() == me.pid:
+                        child.wait(timeout=0)
+                        self.zombies += 1
+                    continue
+                browser = "chrom" in child.name().lower() or (
+                    driver_cache.root is not None and child.exe().startswith(str(driver_cache.root))
+                )
+                stale = time.time() - child.create_time() > self.grace
+            except psutil.Error:
+                continue
+            # A launch in progress has processes that aren't assigned to a session yet
+            if browser and stale and child.pid not in owned and self.launching == 0:
+                self._kill(child, None, "unowned")
+        
+        for path in dirs:
+            shutil.rmtree(path, ignore_errors=True)
+            if not os.path.exists(path):
+                with self._lock:
+                    self._dirs.discard(path)
+                self.profiles_removed += 1
+        self.profiles_removed += sweep_ephemeral_profiles(keep=session_registry.ephemeral_dirs())
+        self.last_sweep = time.time()
+    
+    async def run_once(self) -> None:
+        sessions = {s.session_id: s.process_roots() for s in pool.sessions.values()}
+        # Closed sessions may still be finishing calls; close_browser() hands their processes over
+        sessions.update({s.session_id: s.process_roots() for s in pool.closing.values()})
+        for standby in pool.warm.values():
+            sessions.update({s.session_id: s.process_roots() for s in standby})
+        loop = asyncio.get_event_loop()
+        await loop.run_in_executor(None, self.sweep, sessions)
+    
+    async def _loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.run_once()
+            except Exception:
+                pass
+    
+    def start(self) -> None:
+        if self._task is None and self.interval > 0:
+            self._task = asyncio.create_task(self._loop())
+    
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            self._task = None
+    
+    def info(self) -> Dict[str, Any]:
+        return {
+            "interval": self.interval,
+            "grace": self.grace,
+            "last_sweep": self.last_sweep,
+            "sessions_tracked": len(self._trees),
+            "awaiting_exit": sum(len(procs) for _, _, procs in self._pending),
+            "killed": dict(self.killed),
+            "zombies_reaped": self.zombies,
+            "profiles_removed": self.profiles_removed,
+            "pending_profiles": sorted(self._dirs),
+            "leaks": list(self.leaks),
+        }
+
+reaper = ProcessReaper(interval=REAPER_INTERVAL, grace=REAPER_GRACE)
+
+class ScriptRegistry:
+    """
+    Scripts registered once and then called by handle. Every session installs
+    them with Page.addScriptToEvaluateOnNewDocument, so a call only sends the
+    handle and the arguments. The functions live in a non-enumerable window
+    property whose name is random per process.
+    """
+    def __init__(self):
+        self.scripts: Dict[str, Dict[str, Any]] = {}
+        self.namespace = "_" + uuid.uuid4().hex[:12]
+    
+    def register(self, source: str, name: Optional[str] = None) -> Dict[str, Any]:
+        # Handles are content-addressed, so registering the same source twice is a no-op
+        handle = hashlib.sha256(source.encode()).hexdigest()[:16]
+        script = self.scripts.setdefault(handle, {"handle": handle, "name": name, "source": source, "calls": 0})
+        if name:
+            script["name"] = name
+        return script
+    
+    def get(self, handle: str) -> Dict[str, Any]:
+        script = self.scripts.get(handle)
+        if script is None:
+            raise HTTPException(status_code=404, detail=f"Script '{handle}' not found")
+        return script
+    
+    def remove(self, handle: str) -> None:
+        self.get(handle)
+        del self.scripts[handle]
+    
+    def definition(self, handle: str) -> str:
+        """JavaScript that defines a registered function in the current document"""
+        return (
+            "(function () {"
+            f"var ns = window[{json.dumps(self.namespace)}];"
+            f"if (!ns) {{ ns = {{}}; Object.defineProperty(window, {json.dumps(self.namespace)}, {{value: ns}}); }}"
+            f"ns[{json.dumps(handle)}] = ({self.scripts[handle]['source']});"
+            "})();"
+        )
+    
+    def invocation(self) -> str:
+        """Calls arguments[0] with arguments[1], or returns the namespace name if it isn't defined"""
+        return (
+            f"var ns = window[{json.dumps(self.namespace)}];"
+            f"if (!ns || !ns[arguments[0]]) return {json.dumps(self.namespace)};"
+            "return ns[arguments[0]].apply(null, arguments[1]);"
+        )
+    
+    def info(self) -> List[Dict[str, Any]]:
+        return [
+            {"handle": s["handle"], "name": s["name"], "size": len(s["source"]), "calls": s["calls"]}
+            for s in self.scripts.values()
+        ]
+
+script_registry = ScriptRegistry()
+
+# Managed proxy pool
+PROXY_POOL = "pool"  # the proxy value that draws a proxy from the pool
+PROXY_HEALTH_WINDOW = 20  # recent connections a proxy's failure rate is computed over
+PROXY_ATTEMPTS = 3  # proxies tried for one connection before Chrome gets a 502
+
+class UpstreamProxy:
+    """An upstream HTTP proxy and its recent connect latency and failure rate"""
+    def __init__(self, server: str, username: Optional[str] = None, password: Optional[str] = None):
+        url = urllib.parse.urlsplit(server if "://" in server else f"http://{server}")
+        if url.scheme != "http" or not url.hostname or not url.port:
+            raise HTTPException(status_code=422, detail=f"Unsupported proxy '{url.hostname or server}': expected http://host:port")
+        self.host, self.port = url.hostname, url.port
+        self.server = f"http://{self.host}:{self.port}"  # identifies the proxy, without credentials
+        username = username or (urllib.parse.unquote(url.username) if url.username else None)
+        password = password or (urllib.parse.unquote(url.password) if url.password else None)
+        self.credentials = (username, password or "") if username else None
+        self.auth = b""
+        if self.credentials:
+            token = base64.b64encode(":".join(self.credentials).encode())
+            self.auth = b"Proxy-Authorization: Basic " + token + b"\r\n"
+        self.latency: Optional[float] = None  # moving average of the time to establish a tunnel
+        self.outcomes: deque = deque(maxlen=PROXY_HEALTH_WINDOW)
+        self.connections = 0
+        self.failures = 0
+        self.last_error: Optional[str] = None
+        self.unhealthy_until = 0.0
+        self.assigned = 0
+    
+    @property
+    def failure_rate(self) -> float:
+        return self.outcomes.count(False) / len(self.outcomes) if self.outcomes else 0.0
+    
+    @property
+    def healthy(self) -> bool:
+        return time.monotonic() >= self.unhealthy_until
+    
+    def url(self) -> str:
+        if not self.credentials:
+            return self.server
+        username, password = (urllib.parse.quote(part, safe="") for part in self.credentials)
+        return f"http://{username}:{password}@{self.host}:{self.port}"
+    
+    def score(self) -> float:
+        """Lower is better: expected latency, inflated by failures and by how many sessions share it"""
+        latency = self.latency if self.latency is not None else 1.0
+        return latency * (1 + 4 * self.failure_rate) + 0.1 * self.assigned
+    
+    def record(self, ok: bool, latency: Optional[float] = None, error: Optional[str] = None) -> None:
+        self.connections += 1
+        self.outcomes.append(ok)
+        if ok:
+            self.latency = latency if self.latency is None else 0.7 * self.latency + 0.3 * latency
+        else:
+            self.failures += 1
+            self.last_error = error
+        too_slow = self.latency is not None and self.latency > PROXY_MAX_LATENCY
+        if len(self.outcomes) >= 3 and (self.failure_rate > PROXY_MAX_FAILURE_RATE or too_slow):
+            # Out of rotation for a while; it gets a clean slate afterwards
+            self.unhealthy_until = time.monotonic() + PROXY_COOLDOWN
+            self.outcomes.clear()
+            self.latency = None
+    
+    def info(self) -> Dict[str, Any]:
+        return {
+            "server": self.server,
+            "authenticated": self.credentials is not None,
+            "healthy": self.healthy,
+            "latency": round(self.latency, 3) if self.latency is not None else None,
+            "failure_rate": round(self.failure_rate, 3),
+            "connections": self.connections,
+            "failures": self.failures,
+            "last_error": self.last_error,
+            "assigned_sessions": self.assigned,
+            "cooldown_seconds": round(max(self.unhealthy_until - time.monotonic(), 0), 1),
+        }
+
+class ProxyPool:
+    """Upstream proxies handed out to sessions by health score"""
+    def __init__(self, proxies: Optional[List[UpstreamProxy]] = None):
+        self.proxies: Dict[str, UpstreamProxy] = {}
+        for proxy in proxies or []:
+            self.add(proxy)
+    
+    def add(self, proxy: UpstreamProxy) -> UpstreamProxy:
+        existing = self.proxies.get(proxy.server)
+        if existing is None:
+            self.proxies[proxy.server] = proxy
+            return proxy
+        existing.credentials, existing.auth = proxy.credentials, proxy.auth
+        return existing
+    
+    def remove(self, server: str) -> None:
+        key = UpstreamProxy(server).server
+        if self.proxies.pop(key, None) is None:
+            raise HTTPException(status_code=404, detail=f"Proxy '{key}' not found")
+    
+    def choose(self, exclude: Optional[str] = None) -> Optional[UpstreamProxy]:
+        """The best healthy proxy, or the one closest to the end of its cooldown if none is healthy"""
+        candidates = [p for p in self.proxies.values() if p.server != exclude] or list(self.proxies.values())
+        if not candidates:
+            return None
+        healthy = [p for p in candidates if p.healthy]
+        if healthy:
+            return min(healthy, key=lambda p: p.score())
+        return min(candidates, key=lambda p: p.unhealthy_until)
+    
+    def info(self) -> List[Dict[str, Any]]:
+        return [proxy.info() for proxy in sorted(self.proxies.values(), key=lambda p: p.score())]
+
+proxy_pool = ProxyPool([UpstreamProxy(server.strip()) for server in PROXY_LIST.split(",") if server.strip()])
+
+async def _pipe(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    try:
+        while True:
+            data = await reader.read(65536)
+            if not data:
+                break
+            writer.write(data)
+            await writer.drain()
+        if writer.can_write_eof():
+            writer.write_eof()
+    except (OSError, RuntimeError):
+        pass
+
+class ProxyRelay:
+    """
+    Local proxy that Chrome is pointed at instead of the upstream. Each
+    connection is forwarded to the current upstream with its credentials
+    added (Chrome can't send proxy credentials from the command line). That
+    lets the upstream change without restarting Chrome. Connections that
+    fail are retried on the next best proxy, and the failure counts against
+    the proxy's health.
+    """
+    def __init__(self, proxies: ProxyPool, upstream: Optional[str] = None):
+        self.proxies = proxies
+        self.upstream: Optional[UpstreamProxy] = None
+        self.port: Optional[int] = None
+        self.rotations = 0
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._writers: set = set()
+        self._assign(proxies.proxies.get(upstream) if upstream else None)
+    
+    async def start(self) -> None:
+        if self.upstream is None:
+            self._assign(self.proxies.choose())
+        if self.upstream is None:
+            raise HTTPException(status_code=503, detail="Proxy pool is empty")
+        self._server = await asyncio.start_server(self._handle, "127.0.0.1", 0)
+        self.port = self._server.sockets[0].getsockname()[1]
+    
+    def _assign(self, proxy: Optional[UpstreamProxy]) -> None:
+        if self.upstream is not None:
+            self.upstream.assigned -= 1
+        self.upstream = proxy
+        if proxy is not None:
+            proxy.assigned += 1
+    
+    def _current(self) -> Optional[UpstreamProxy]:
+        # Sticky until the proxy is removed or taken out of rotation
+        if self.upstream is None or self.proxies.proxies.get(self.upstream.server) is not self.upstream or not self.upstream.healthy:
+            self._assign(self.proxies.choose(exclude=self.upstream.server if self.upstream else None))
+        return self.upstream
+    
+    def rotate(self) -> Optional[UpstreamProxy]:
+        """Switch to the best other proxy and drop open connections so Chrome reconnects through it"""
+        self._assign(self.proxies.choose(exclude=self.upstream.server if self.upstream else None))
+        self.rotations += 1
+        for writer in list(self._writers):
+            writer.close()
+        return self.upstream
+    
+    @staticmethod
+    def _forward_head(head: bytes, proxy: UpstreamProxy) -> bytes:
+        """A plain-HTTP request head with our credentials, one request per connection"""
+        lines = head[:-4].split(b"\r\n")
+        dropped = (b"proxy-authorization", b"proxy-connection", b"connection")
+        kept = [lines[0]] + [line for line in lines[1:] if line.split(b":", 1)[0].strip().lower() not in dropped]
+        return b"\r\n".join(kept) + b"\r\n" + proxy.auth + b"Connection: close\r\n\r\n"
+    
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self._writers.add(writer)
+        upstream_writer = None
+        try:
+            try:
+                head = await reader.readuntil(b"\r\n\r\n")
+                method, target = head.split(b" ", 2)[:2]
+            except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, OSError, ValueError):
+                return
+            for _ in range(PROXY_ATTEMPTS):
+                proxy = self._current()
+                if proxy is None:
+                    break
+                started = time.perf_counter()
+                try:
+                    upstream_reader, upstream_writer = await asyncio.wait_for(
+                        asyncio.open_connection(proxy.host, proxy.port), PROXY_CONNECT_TIMEOUT
+                    )
+                    if method == b"CONNECT":
+                        upstream_writer.write(b"CONNECT " + target + b" HTTP/1.1\r\nHost: " + target + b"\r\n" + proxy.auth + b"\r\n")
+                        response = await asyncio.wait_for(upstream_reader.readuntil(b"\r\n\r\n"), PROXY_CONNECT_TIMEOUT)
+                        if response.split(b" ", 2)[1] == b"407":
+                            raise ConnectionError("proxy rejected the credentials")
+                        # Any other answer (including the target being unreachable) is the site's problem, not the proxy's
+                        writer.write(response)
+                    else:
+                        upstream_writer.write(self._forward_head(head, proxy))
+                    proxy.record(True, time.perf_counter() - started)
+                    break
+                except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, IndexError) as e:
+                    proxy.record(False, error=str(e) or type(e).__name__)
+                    if upstream_writer is not None:
+                        upstream_writer.close()
+                        upstream_writer = None
+                    self._assign(self.proxies.choose(exclude=proxy.server))
+            if upstream_writer is None:
+                writer.write(b"HTTP/1.1 502 Bad Gateway\r\nContent-Length: 0\r\nConnection: close\r\n\r\n")
+                return
+            self._writers.add(upstream_writer)
+            await asyncio.gather(_pipe(reader, upstream_writer), _pipe(upstream_reader, writer))
+        finally:
+            for w in (writer, upstream_writer):
+                if w is not None:
+                    self._writers.discard(w)
+                    w.close()
+    
+    async def close(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            self._server = None
+        for writer in list(self._writers):
+            writer.close()
+        self._assign(None)
+
+class Tab:
+    """
+    An extra page in a session's browser, driven directly over its DevTools
+    WebSocket instead of through chromedriver, which stays on the session's
+    main window. Tabs share the browser's cookies and load in parallel with
+    each other; calls on one tab run one at a time.
+    """
+    def __init__(self, target_id: str, ws_url: str, labels: Dict[str, str]):
+        self.tab_id = target_id
+        self.ws_url = ws_url
+        self.labels = labels
+        self.url: Optional[str] = None
+        self.created_at = time.time()
+        self.navigations = 0
+        self.closed = False
+        self.lock = asyncio.Lock()
+        self._ws = None
+        self._reader: Optional[asyncio.Task] = None
+        self._next_id = 0
+        self._replies: Dict[int, asyncio.Future] = {}
+        self._lifecycle: Dict[str, Dict[str, set]] = {}  # frame ID -> loader ID -> lifecycle events seen for that document
+        self._progress = asyncio.Event()
+        self._blocked_patterns: Optional[List[str]] = None
+        self._blocked_types: List[str] = []
+        self._tracking = False
+        self.document: Optional[Dict[str, Any]] = None  # main frame's last document response, once tracked
+    
+    async def connect(self) -> None:
+        self._ws = await websockets.connect(self.ws_url, max_size=None)
+        self._reader = asyncio.ensure_future(self._read())
+        await self.send("Page.enable")
+        await self.send("Page.setLifecycleEventsEnabled", {"enabled": True})
+    
+    async def _read(self) -> None:
+        try:
+            async for raw in self._ws:
+                message = json.loads(raw)
+                if "id" in message:
+                    future = self._replies.pop(message["id"], None)
+                    if future and not future.done():
+                        future.set_result(message)
+                elif message.get("method") == "Page.lifecycleEvent":
+                    params = message["params"]
+                    loaders = self._lifecycle.setdefault(params["frameId"], {})
+                    if params["name"] == "init":
+                        # A new document replaces the frame's earlier ones; other frames are unaffected
+                        loaders.clear()
+                    loaders.setdefault(params["loaderId"], set()).add(params["name"])
+                    self._progress.set()
+                    self._progress = asyncio.Event()
+                elif message.get("method") == "Page.frameDetached":
+                    self._lifecycle.pop(message["params"]["frameId"], None)
+                elif message.get("method") == "Network.responseReceived":
+                    params = message["params"]
+                    # A page target's main frame has the target's ID
+                    if params.get("type") == "Document" and params.get("frameId") == self.tab_id:
+                        self.document = params["response"]
+                elif message.get("method") == "Fetch.requestPaused":
+                    # Only blocked resource types are intercepted (see _set_blocked_types)
+                    self._post("Fetch.failRequest", {
+                        "requestId": message["params"]["requestId"], "errorReason": "BlockedByClient",
+                    })
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            self.closed = True
+            self._progress.set()
+            for future in self._replies.values():
+                if not future.done():
+                    future.set_exception(self._gone())
+    
+    def _gone(self) -> HTTPException:
+        return HTTPException(status_code=404, detail=f"Tab '{self.tab_id}' was closed")
+    
+    async def send(self, method: str, params: Optional[Dict[str, Any]] = None, timeout: float = 30) -> Dict[str, Any]:
+        """Send a CDP command to this tab and return its result"""
+        if self.closed:
+            raise self._gone()
+        self._next_id += 1
+        message_id = self._next_id
+        future = asyncio.get_event_loop().create_future()
+        self._replies[message_id] = future
+        try:
+            await self._ws.send(json.dumps({"id": message_id, "method": method, "params": params or {}}))
+            reply = await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            raise HTTPException(status_code=504, detail=f"{method} timed out")
+        except websockets.ConnectionClosed:
+            raise self._gone()
+        finally:
+            self._replies.pop(message_id, None)
+        if "error" in reply:
+            raise HTTPException(status_code=500, detail=f"{method} failed: {reply['error'].get('message')}")
+        return reply.get("result", {})
+    
+    def _post(self, method: str, params: Dict[str, Any]) -> None:
+        """Send a CDP command without waiting for its reply, for use from the reader"""
+        self._next_id += 1
+        message = json.dumps({"id": self._next_id, "method": method, "params": params})
+        
+        async def post():
+            try:
+                await self._ws.send(message)
+            except websockets.ConnectionClosed:
+                pass
+        asyncio.ensure_future(post())
+    
+    @asynccontextmanager
+    async def _timed(self, phase: str):
+        started = time.perf_counter()
+        try:
+            yield
+        except Exception as e:
+            metrics.errors.inc(phase=phase, exception=type(e).__name__, **self.labels)
+            raise
+        finally:
+            metrics.phase_seconds.observe(time.perf_counter() - started, phase=phase, **self.labels)
+    
+    async def _set_blocked(self, patterns: List[str]) -> None:
+        if patterns == self._blocked_patterns or (not patterns and self._blocked_patterns is None):
+            return
+        if self._blocked_patterns is None:
+            await self.send("Network.enable")
+        await self.send("Network.setBlockedURLs", {"urls": patterns})
+        self._blocked_patterns = patterns
+    
+    async def track_documents(self) -> None:
+        """Keep the main frame's document response in `document` from now on"""
+        if not self._tracking:
+            await self.send("Network.enable")
+            self._tracking = True
+    
+    async def _set_blocked_types(self, types: List[str]) -> None:
+        """Intercept requests of the given resource types so the reader can fail them"""
+        if types == self._blocked_types:
+            return
+        if types:
+            await self.send("Fetch.enable", {"patterns": [
+                {"urlPattern": "*", "resourceType": t, "requestStage": "Request"} for t in types
+            ]})
+        else:
+            await self.send("Fetch.disable")
+        self._blocked_types = types
+    
+    async def _wait_lifecycle(self, frame_id: str, loader_id: str, name: str, deadline: float) -> None:
+        while name not in self._lifecycle.get(frame_id, {}).get(loader_id, ()):
+            if self.closed:
+                raise self._gone()
+            progress = self._progress
+            try:
+                await asyncio.wait_for(progress.wait(), max(deadline - time.perf_counter(), 0))
+            except asyncio.TimeoutError:
+                raise HTTPException(status_code=504, detail="Timed out waiting for the page to load")
+    
+    async def _wait_until(self, wait: WaitConditions, deadline: float) -> None:
+        script = f"(function () {{ {wait_script(wait)} }})()"
+        resources, changed_at = -1, time.perf_counter()
+        while True:
+            try:
+                ready, count = await self.evaluate(script, timeout=max(deadline - time.perf_counter(), 0.1))
+            except HTTPException as e:
+                if e.status_code == 404:
+                    raise
+                ready, count = False, resources
+            now = time.perf_counter()
+            if count != resources:
+                resources, changed_at = count, now
+            idle = not wait.network_idle_ms or (now - changed_at) * 1000 >= wait.network_idle_ms
+            if ready and idle:
+                return
+            if now >= deadline:
+                raise HTTPException(status_code=504, detail="Timed out waiting for the page to become ready")
+            await asyncio.sleep(WAIT_POLL_INTERVAL)
+    
+    async def navigate(self, url: str, timeout: int = 30, patterns: Optional[List[str]] = None,
+                       strategy: str = "normal", wait: Optional[WaitConditions] = None,
+                       types: Optional[List[str]] = None) -> str:
+        """Navigate the tab and return the page title, with the same strategies as the main window"""
+        validate_page_load_strategy(strategy)
+        async with self._timed("navigate"):
+            started = time.perf_counter()
+            deadline = started + timeout
+            await self._set_blocked(patterns or [])
+            await self._set_blocked_types(types or [])
+            await self.load(url, strategy, deadline)
+            if wait is not None:
+                await self._wait_until(wait, deadline)
+            metrics.page_load_seconds.observe(
+                time.perf_counter() - started, blocking="on" if patterns or types else "off", strategy=strategy
+            )
+            self.navigations += 1
+            self.url = url
+            return await self.evaluate("document.title")
+    
+    async def load(self, url: str, strategy: str, deadline: float) -> None:
+        """
+        Start a navigation and wait for the strategy's lifecycle event of the
+        document it creates (Page.navigate itself returns once it commits)
+        """
+        response = await self.send("Page.navigate", {"url": url}, max(deadline - time.perf_counter(), 0.1))
+        if response.get("errorText"):
+            raise HTTPException(status_code=500, detail=f"Navigation failed: {response['errorText']}")
+        # Same-document navigations have no loader and fire no load events
+        loader_id = response.get("loaderId")
+        if loader_id and strategy != "none":
+            await self._wait_lifecycle(
+                response["frameId"], loader_id, "load" if strategy == "normal" else "DOMContentLoaded", deadline
+            )
+    
+    async def evaluate(self, expression: str, await_promise: bool = False, timeout: float = 30) -> Any:
+        result = await self.send("Runtime.evaluate", {
+            "expression": expression, "returnByValue": True, "awaitPromise": await_promise,
+        }, timeout)
+        if "exceptionDetails" in result:
+            details = result["exceptionDetails"]
+            message = details.get("exception", {}).get("description") or details.get("text")
+            raise HTTPException(status_code=500, detail=f"JavaScript execution failed: {message}")
+        return result.get("result", {}).get("value")
+    
+    async def execute_js(self, script: str, timeout: int = 30, await_promise: bool = False) -> Any:
+        async with self._timed("script"):
+            return await self.evaluate(f"(function () {{ return {script}\n}})()", await_promise, timeout)
+    
+    async def get_html(self) -> str:
+        async with self._timed("page_source"):
+            return await self.evaluate("document.documentElement.outerHTML")
+    
+    async def get_screenshot(self) -> str:
+        async with self._timed("screenshot"):
+            # Chrome only paints the tab in front
+            await self.send("Page.bringToFront")
+            return (await self.send("Page.captureScreenshot", {"format": "png"}))["data"]
+    
+    async def close(self) -> None:
+        self.closed = True
+        if self._ws is not None:
+            await self._ws.close()
+        if self._reader is not None:
+            self._reader.cancel()
+    
+    def info(self) -> Dict[str, Any]:
+        return {"tab_id": self.tab_id, "url": self.url, "navigations": self.navigations, "created_at": self.created_at}
+
+# Browser controller class
+class BrowserController:
+    def __init__(self, session_id: Optional[str] = None):
+        self.session_id: str = session_id or uuid.uuid4().hex
+        self.driver: Optional[Any] = None
+        self.current_profile: Optional[str] = None
+        self.user_data_dir: Optional[str] = None  # set for throwaway profiles only
+        self.headless: bool = False
+        self.proxy: Optional[str] = None
+        self.relay: Optional[ProxyRelay] = None  # local relay for pooled or authenticated proxies
+        self.proxy_upstream: Optional[str] = None  # the pool proxy this session sticks to across relaunches
+        self.template: Optional[str] = None  # profile a throwaway profile was cloned from
+        self.tmpfs: bool = False
+        self.created_at: float = time.time()
+        self.last_used: float = time.monotonic()
+        self.in_flight: int = 0
+        # WebDriver calls block, so each browser gets its own worker thread.
+        # The semaphore bounds how many calls may wait for it at once.
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"driver-{self.session_id[:8]}")
+        self._slots = asyncio.Semaphore(DRIVER_QUEUE_SIZE)
+        self.queued: int = 0
+        # API calls on one session run one at a time, in arrival order
+        # (asyncio.Lock hands over to waiters first-in first-out)
+        self._session_lock = asyncio.Lock()
+        self.pending: int = 0
+        # Supervisor bookkeeping
+        self.launched_at: float = time.monotonic()
+        self.navigations: int = 0
+        self.recycles: int = 0
+        self.recycle_reason: Optional[str] = None
+        self.resources: Optional[Dict[str, float]] = None
+        self._procs: Dict[int, psutil.Process] = {}
+        # Session-wide resource blocking, applied lazily before each navigation
+        self.block_rules: Optional[BlockRules] = None
+        self._blocked_patterns: Optional[List[str]] = None
+        self._page: Optional[Tab] = None  # DevTools connection to the main window, for blocking and response headers
+        self._scripts: Dict[str, str] = {}  # registered script handle -> CDP identifier in this browser
+        # Extra tabs beside the main window, reached through Chrome's DevTools endpoint
+        self.tabs: Dict[str, Tab] = {}
+        self.debugger_address: Optional[str] = None
+        self.reattached: bool = False  # taken over from an earlier process rather than launched
+    
+    @asynccontextmanager
+    async def exclusive(self, force: bool = False):
+        """
+        Hold the session for a sequence of driver calls. When SESSION_QUEUE_DEPTH
+        calls are already holding or waiting for it, fail fast with a 429
+        unless force is set (used for closing the session).
+        """
+        if not force and self.pending >= SESSION_QUEUE_DEPTH:
+            raise HTTPException(status_code=429, detail=f"Session '{self.session_id}' is busy ({self.pending} calls queued)")
+        self.pending += 1
+        try:
+            async with self._session_lock:
+                yield self
+        finally:
+            self.pending -= 1
+    
+    def metric_labels(self) -> Dict[str, str]:
+        profile = self.current_profile or "ephemeral"  # start_browser() sets it before timing anything
+        return {"profile": profile, "headless": str(self.headless).lower()}
+    
+    def process_roots(self) -> List[int]:
+        """PIDs of this session's Chrome and chromedriver processes"""
+        service = getattr(self.driver, "service", None)
+        pids = [getattr(self.driver, "browser_pid", None), getattr(getattr(service, "process", None), "pid", None)]
+        return [pid for pid in pids if pid]
+    
+    def process_rss(self) -> Optional[int]:
+        """Total resident memory of the Chrome process tree, or None if it can't be read"""
+        tree = process_tree(getattr(self.driver, "browser_pid", None))
+        if not tree:
+            return None
+        total = 0
+        for proc in tree:
+            try:
+                total += proc.memory_info().rss
+            except psutil.Error:
+                pass
+        return total
+    
+    def sample_resources(self) -> Optional[Dict[str, float]]:
+        """Sample RSS and CPU of the Chrome process tree (blocking, run off the event loop)"""
+        tree = process_tree(getattr(self.driver, "browser_pid", None))
+        if not tree:
+            self.resources = None
+            return None
+        rss, cpu, procs = 0, 0.0, {}
+        for proc in tree:
+            # Reuse Process objects so cpu_percent() measures since the previous sample
+            proc = self._procs.get(proc.pid, proc)
+            try:
+                rss += proc.memory_info().rss
+                cpu += proc.cpu_percent(None)
+                procs[proc.pid] = proc
+            except psutil.Error:
+                pass
+        self._procs = procs
+        self.resources = {"rss_bytes": rss, "cpu_percent": round(cpu, 1), "processes": len(procs)}
+        return self.resources
+    
+    async def recycle(self) -> None:
+        """Restart the browser with the same profile and options, returning to the current page"""
+        url = None
+        try:
+            url = await self._run(lambda: self.driver.current_url)
+        except Exception:
+            pass
+        await self.close_browser()
+        await self.start_browser(headless=self.headless, proxy=self.proxy, profile_name=self.current_profile,
+                                 template=self.template, tmpfs=self.tmpfs)
+        self.recycles += 1
+        if url and url.startswith(("http://", "https://")):
+            try:
+                await self.navigate_to(url)
+            except HTTPException:
+                pass
+    
+    def _timed(self, phase: str, fn):
+        """Wrap a driver call so its duration and any error are recorded under a phase"""
+        labels = self.metric_labels()
+        
+        def timed(*args):
+            started = time.perf_counter()
+            try:
+                return fn(*args)
+            except Exception as e:
+                metrics.errors.inc(phase=phase, exception=type(e).__name__, **labels)
+                raise
+            finally:
+                metrics.phase_seconds.observe(time.perf_counter() - started, phase=phase, **labels)
+        return timed
+    
+    async def _run(self, fn, *args, phase: Optional[str] = None) -> Any:
+        """Run a blocking driver call on this browser's worker thread"""
+        if phase:
+            fn = self._timed(phase, fn)
+        self.queued += 1
+        try:
+            try:
+                await asyncio.wait_for(self._slots.acquire(), DRIVER_QUEUE_TIMEOUT)
+            except asyncio.TimeoutError:
+                raise HTTPException(status_code=503, detail="Browser is busy, try again later")
+            try:
+                loop = asyncio.get_event_loop()
+                return await loop.run_in_executor(self._executor, functools.partial(fn, *args))
+            finally:
+                self._slots.release()
+        finally:
+            self.queued -= 1
+    
+    def _require_driver(self) -> None:
+        if not self.driver:
+            raise HTTPException(status_code=400, detail="Browser not started")
+        
+    async def start_browser(self, headless: bool = False, proxy: Optional[str] = None, profile_name: Optional[str] = "default",
+                            template: Optional[str] = None, tmpfs: bool = False) -> None:
+        """
+        Start a new browser instance with the given options and profile. A
+        profile_name of None gives a throwaway profile, empty or cloned from
+        a template profile, and on tmpfs if asked.
+        """
+        # Close any existing session
+        if self.driver:
+            await self.close_browser()
+            
+        # Keep tabs that aren't in front loading at full speed
+        arguments = [
+            '--disable-background-timer-throttling',
+            '--disable-backgrounding-occluded-windows',
+            '--disable-renderer-backgrounding',
+        ]
+        
+        if proxy == PROXY_POOL or (proxy and "@" in proxy):
+            # Chrome ignores credentials in --proxy-server, so these go through a local relay
+            proxies = proxy_pool if proxy == PROXY_POOL else ProxyPool([UpstreamProxy(proxy)])
+            self.relay = ProxyRelay(proxies, self.proxy_upstream if proxy == PROXY_POOL else None)
+            await self.relay.start()
+            self.proxy_upstream = self.relay.upstream.server
+            arguments.append(f'--proxy-server=http://127.0.0.1:{self.relay.port}')
+        elif proxy:
+            arguments.append(f'--proxy-server={proxy}')
+        
+        # Launch options first: they label the metrics of every phase below
+        self.current_profile = profile_name
+        self.template = template if profile_name is None else None
+        self.tmpfs = tmpfs and profile_name is None
+        self.headless = headless
+        self.proxy = proxy
+        
+        # Set up user data directory for the profile
+        if profile_name is None:
+            self.user_data_dir = await self._run(make_ephemeral_profile, template, tmpfs, phase="profile")
+            profile_path = Path(self.user_data_dir)
+        else:
+            profile_path = PROFILES_DIR / profile_name
+            profile_path.mkdir(exist_ok=True)
+        
+        def start(**extra):
+            # uc.Chrome won't take the same options object twice, so each attempt gets its own
+            options = uc.ChromeOptions()
+            # chromedriver must not wait for page loads by itself, or every command
+            # would block until the load event; navigate_to does the waiting
+            options.page_load_strategy = "none"
+            for argument in arguments:
+                options.add_argument(argument)
+            return uc.Chrome(
+                headless=headless,
+                options=options,
+                user_data_dir=str(profile_path),
+                use_subprocess=True,
+                **extra
+            )
+        
+        def launch():
+            started = time.perf_counter()
+            try:
+                driver_path, version_main, status = driver_cache.get()
+            except Exception:
+                # Fall back to undetected-chromedriver's own download and patching
+                driver_path, version_main, status = None, None, "disabled"
+            if driver_path:
+                try:
+                    driver = start(driver_executable_path=driver_path, version_main=version_main)
+                except SessionNotCreatedException:
+                    # The cached driver doesn't match Chrome any more (it was updated):
+                    # detect the version again next time and let uc patch one now
+                    driver_cache.invalidate()
+                    driver, status = start(), "fallback"
+            else:
+                driver = start()
+            driver_cache.record_launch(status, time.perf_counter() - started)
+            return driver
+        
+        reaper.launching += 1
+        try:
+            self.driver = await self._run(launch, phase="launch")
+            self.launched_at = time.monotonic()
+            self.navigations = 0
+            self._procs = {}
+            self._blocked_patterns = None
+            self._scripts = {}
+            self.debugger_address = getattr(getattr(self.driver, "options", None), "debugger_address", None)
+            self.reattached = False
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Failed to start browser: {str(e)}")
+        finally:
+            reaper.launching -= 1
+    
+    def _set_blocked(self, patterns: List[str]) -> None:
+        """Install URL block patterns through CDP, skipping the call when nothing changed"""
+        if patterns == self._blocked_patterns or (not patterns and self._blocked_patterns is None):
+            return
+        if self._blocked_patterns is None:
+            self.driver.execute_cdp_cmd("Network.enable", {})
+        self.driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": patterns})
+        self._blocked_patterns = patterns
+    
+    async def _set_blocked_types(self, types: List[str]) -> None:
+        """
+        Fail requests of the given resource types in the main window. Fetch
+        interception needs someone to answer every paused request, which
+        chromedriver can't do, so it runs over a DevTools connection of our own.
+        """
+        if (self._page is None or self._page.closed) and not types:
+            return
+        await (await self._devtools_page())._set_blocked_types(types)
+    
+    async def _devtools_page(self) -> Tab:
+        if self._page is None or self._page.closed:
+            if not self.debugger_address:
+                raise HTTPException(status_code=500, detail="Browser has no DevTools endpoint")
+            ws_url = await self.devtools_url()
+            # Named after the window's target ID, which is also its main frame's ID
+            page = Tab(ws_url.rsplit("/", 1)[-1], ws_url, self.metric_labels())
+            try:
+                await page.connect()
+            except Exception as e:
+                await page.close()
+                raise HTTPException(status_code=500, detail=f"Failed to connect to DevTools: {str(e)}")
+            self._page = page
+        return self._page
+    
+    async def _navigation_page(self) -> Optional[Tab]:
+        """The main window's DevTools connection, or None when there is none to be had"""
+        if not self.debugger_address:
+            return None
+        try:
+            return await self._devtools_page()
+        except HTTPException:
+            return None
+    
+    async def track_documents(self) -> None:
+        """Record the main window's document responses, for `validators`"""
+        await (await self._devtools_page()).track_documents()
+    
+    @property
+    def validators(self) -> Dict[str, str]:
+        """
+        Conditional request headers (If-None-Match / If-Modified-Since) for the
+        current page, from its response as the browser received it. Empty
+        unless track_documents() was called before navigating.
+        """
+        document = self._page.document if self._page is not None else None
+        if not document:
+            return {}
+        headers = {name.lower(): value for name, value in document.get("headers", {}).items()}
+        validators = {"If-None-Match": headers.get("etag"), "If-Modified-Since": headers.get("last-modified")}
+        return {name: value for name, value in validators.items() if value}
+    
+    async def _close_page(self) -> None:
+        if self._page is not None:
+            page, self._page = self._page, None
+            await page.close()
+    
+    def _sync_scripts(self) -> None:
+        """Install newly registered scripts for future documents and drop removed ones"""
+        for handle in [h for h in self._scripts if h not in script_registry.scripts]:
+            self.driver.execute_cdp_cmd("Page.removeScriptToEvaluateOnNewDocument", {"identifier": self._scripts.pop(handle)})
+        for handle in [h for h in script_registry.scripts if h not in self._scripts]:
+            response = self.driver.execute_cdp_cmd(
+                "Page.addScriptToEvaluateOnNewDocument", {"source": script_registry.definition(handle)}
+            )
+            self._scripts[handle] = response["identifier"]
+    
+    def _wait_until(self, wait: WaitConditions, deadline: float, ready_state: Optional[str] = None,
+                    time_origin: Any = None) -> None:
+        """Poll the page until every wait condition holds (blocking, runs on the worker thread)"""
+        script = wait_script(wait, ready_state, time_origin)
+        resources, changed_at = -1, time.perf_counter()
+        while True:
+            try:
+                ready, count = self.driver.execute_script(script)
+            except Exception:
+                # The document may be swapped out under us while it commits
+                ready, count = False, resources
+            now = time.perf_counter()
+            if count != resources:
+                resources, changed_at = count, now
+            idle = not wait.network_idle_ms or (now - changed_at) * 1000 >= wait.network_idle_ms
+            if ready and idle:
+                return
+            if now >= deadline:
+                raise HTTPException(status_code=504, detail="Timed out waiting for the page to become ready")
+            time.sleep(WAIT_POLL_INTERVAL)
+    
+    async def navigate_to(self, url: str, timeout: int = 30, block: Optional[BlockRules] = None,
+                          strategy: str = "normal", wait: Optional[WaitConditions] = None) -> str:
+        """
+        Navigate to a URL and return the page title. The "normal" strategy waits
+        for the load event; "eager" returns once the DOM is parsed and "none"
+        as soon as the navigation has committed. Wait conditions are checked
+        afterwards, all within the same timeout.
+        """
+        self._require_driver()
+        validate_page_load_strategy(strategy)
+        session_patterns = block_patterns(self.block_rules)
+        patterns = block_patterns(block) if block is not None else session_patterns
+        session_types = block_types(self.block_rules)
+        types = block_types(block) if block is not None else session_types
+        
+        await self._set_blocked_types(types)
+        page = await self._navigation_page()
+        if page is not None:
+            page.document = None
+        loop = asyncio.get_event_loop()
+        
+        def navigate():
+            self.navigations += 1
+            self._set_blocked(patterns)
+            self._sync_scripts()
+            try:
+                started = time.perf_counter()
+                deadline = started + timeout
+                if page is not None:
+                    # Waits on the lifecycle events of the navigation's own loader, so the
+                    # previous (already loaded) document can't pass for the new one.
+                    # The DevTools connection lives on the event loop, which is free meanwhile.
+                    asyncio.run_coroutine_threadsafe(page.load(url, strategy, deadline), loop).result()
+                    if wait is not None:
+                        self._wait_until(wait, deadline)
+                else:
+                    # Sessions run with chromedriver's "none" strategy, so get() returns at
+                    # once; the new document is told from the previous one by its time origin
+                    same_document = "#" in url and (
+                        urllib.parse.urldefrag(self.driver.current_url)[0] == urllib.parse.urldefrag(url)[0]
+                    )
+                    previous = None if same_document else self.driver.execute_script("return performance.timeOrigin")
+                    self.driver.set_page_load_timeout(timeout)
+                    self.driver.get(url)
+                    conditions = wait or WaitConditions()
+                    if strategy == "eager":
+                        conditions = WaitConditions(**{**conditions.dict(), "dom_content_loaded": True})
+                    self._wait_until(conditions, deadline, "complete" if strategy == "normal" else None, previous)
+                elapsed = time.perf_counter() - started
+                title = self.driver.title
+                try:
+                    transferred = self.driver.execute_script(
+                        "return performance.getEntriesByType('navigation').concat(performance.getEntriesByType('resource'))"
+                        ".reduce(function (total, e) { return total + (e.transferSize || 0); }, 0);"
+                    )
+                    blocking = "on" if patterns or types else "off"
+                    metrics.page_load_seconds.observe(elapsed, blocking=blocking, strategy=strategy)
+                    metrics.page_bytes.observe(float(transferred or 0), blocking=blocking)
+                except Exception:
+                    pass
+                return title
+            finally:
+                # Per-request rules only last for this navigation
+                if patterns != session_patterns:
+                    self._set_blocked(session_patterns)
+        
+        try:
+            return await self._run(navigate, phase="navigate")
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Navigation failed: {str(e)}")
+        finally:
+            if types != session_types:
+                try:
+                    await self._set_blocked_types(session_types)
+                except HTTPException:
+                    pass  # the connection is gone, and with it the interception
+    
+    async def execute_js(self, script: str, timeout: int = 30, await_promise: bool = False) -> Any:
+        """Execute JavaScript in the browser and return the result"""
+        self._require_driver()
+        if await_promise:
+            result = (await self.execute_js_batch([script], timeout, await_promise=True))[0]
+            if not result["success"]:
+                raise HTTPException(status_code=500, detail=f"JavaScript execution failed: {result['error']}")
+            return result["value"]
+        
+        def execute():
+            self.driver.set_script_timeout(timeout)
+            return self.driver.execute_script(f"return {script}")
+        
+        try:
+            return await self._run(execute, phase="script")
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"JavaScript execution failed: {str(e)}")
+    
+    async def execute_cdp(self, method: str, params: Dict[str, Any]) -> Any:
+        """Send a raw DevTools Protocol command to the current tab"""
+        self._require_driver()
+        try:
+            return await self._run(lambda: self.driver.execute_cdp_cmd(method, params), phase="cdp")
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"CDP command failed: {str(e)}")
+    
+    async def devtools_url(self) -> str:
+        """WebSocket URL of the current tab's DevTools endpoint, for direct CDP connections"""
+        self._require_driver()
+        
+        def resolve():
+            # chromedriver window handles are DevTools target IDs
+            return f"ws://{self.driver.options.debugger_address}/devtools/page/{self.driver.current_window_handle}"
+        
+        return await self._run(resolve)
+    
+    async def execute_js_batch(self, scripts: List[str], timeout: int = 30, await_promise: bool = False) -> List[Dict[str, Any]]:
+        """
+        Evaluate several expressions in one WebDriver call. Each gets its own
+        {"success", "value"} or {"success", "error"} entry, so one throwing
+        doesn't lose the others. With await_promise the call is made with
+        execute_async_script and returned promises are awaited.
+        """
+        self._require_driver()
+        functions = ", ".join(f"function () {{ return ({script}\n); }}" for script in scripts)
+        evaluate = "function (fn) { var value = fn(); return typeof value === 'function' ? value() : value; }"
+        if await_promise:
+            source = (
+                "var done = arguments[arguments.length - 1];"
+                f"var evaluate = {evaluate};"
+                f"Promise.all([{functions}].map(function (fn) {{"
+                "  return new Promise(function (resolve) { resolve(evaluate(fn)); }).then("
+                "    function (value) { return {success: true, value: value}; },"
+                "    function (e) { return {success: false, error: String(e)}; });"
+                "})).then(done);"
+            )
+        else:
+            source = (
+                f"var evaluate = {evaluate};"
+                f"return [{functions}].map(function (fn) {{"
+                "  try { return {success: true, value: evaluate(fn)}; }"
+                "  catch (e) { return {success: false, error: String(e)}; }"
+                "});"
+            )
+        
+        def execute():
+            self.driver.set_script_timeout(timeout)
+            if await_promise:
+                return self.driver.execute_async_script(source)
+            return self.driver.execute_script(source)
+        
+        try:
+            return await self._run(execute, phase="script")
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"JavaScript execution failed: {str(e)}")
+    
+    async def call_script(self, handle: str, args: List[Any], timeout: int = 30) -> Any:
+        """Call a registered script by handle, passing only its arguments"""
+        self._require_driver()
+        script = script_registry.get(handle)
+        
+        def call():
+            self._sync_scripts()
+            self.driver.set_script_timeout(timeout)
+            result = self.driver.execute_script(script_registry.invocation(), handle, args)
+            if result == script_registry.namespace:
+                # The document was loaded before the script was installed
+                self.driver.execute_script(script_registry.definition(handle))
+                result = self.driver.execute_script(script_registry.invocation(), handle, args)
+            script["calls"] += 1
+            return result
+        
+        try:
+            return await self._run(call, phase="script")
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"JavaScript execution failed: {str(e)}")
+    
+    async def get_html(self) -> str:
+        """Get the current page HTML"""
+        self._require_driver()
+        
+        try:
+            return await self._run(lambda: self.driver.page_source, phase="page_source")
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Failed to get HTML: {str(e)}")
+    
+    async def extract_html(self, selector: Optional[str] = None, mode: str = "html", match_all: bool = False) -> str:
+        """
+        Return the page (or the element(s) matching a CSS selector) as HTML or
+        as text content. Selection happens in the browser so only the part
+        that was asked for crosses the WebDriver connection.
+        """
+        self._require_driver()
+        
+        def extract():
+            if selector is None and mode == "html":
+                return self.driver.page_source
+            return self.driver.execute_script(
+                "var selector = arguments[0], text = arguments[1], all = arguments[2];"
+                "if (selector === null) { return text ? document.body.innerText : document.documentElement.outerHTML; }"
+                "var nodes = all ? Array.prototype.slice.call(document.querySelectorAll(selector))"
+                " : [document.querySelector(selector)].filter(Boolean);"
+                "if (!nodes.length) { return null; }"
+                "return nodes.map(function (n) { return text ? n.innerText : n.outerHTML; }).join('\\n');",
+                selector, mode == "text", match_all
+            )
+        
+        try:
+            content = await self._run(extract, phase="page_source")
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Failed to get HTML: {str(e)}")
+        if content is None:
+            raise HTTPException(status_code=404, detail=f"No element matches selector '{selector}'")
+        return content
+    
+    async def get_screenshot(self) -> str:
+        """Take a screenshot and return as base64 string"""
+        self._require_driver()
+        
+        try:
+            return await self._run(lambda: self.driver.get_screenshot_as_base64(), phase="screenshot")
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Failed to take screenshot: {str(e)}")
+    
+    async def capture_screenshot(self, fmt: str = "png", quality: Optional[int] = None, scale: float = 1.0,
+                                 clip: Optional[Tuple[float, float, float, float]] = None, full_page: bool = False) -> bytes:
+        """Capture the page through CDP, encoded by Chrome itself, and return the raw image bytes"""
+        self._require_driver()
+        
+        def capture():
+            params: Dict[str, Any] = {"format": fmt, "captureBeyondViewport": full_page}
+            if quality is not None and fmt != "png":
+                params["quality"] = quality
+            region = clip
+            if region is None and (full_page or scale != 1.0):
+                width, height = self.driver.execute_script(
+                    "var d = document.documentElement;"
+                    "return arguments[0] ? [Math.max(d.scrollWidth, window.innerWidth), Math.max(d.scrollHeight, window.innerHeight)]"
+                    " : [window.innerWidth, window.innerHeight];",
+                    full_page
+                )
+                region = (0, 0, width, height)
+            if region is not None:
+                x, y, width, height = region
+                params["clip"] = {"x": x, "y": y, "width": width, "height": height, "scale": scale}
+            return base64.b64decode(self.driver.execute_cdp_cmd("Page.captureScreenshot", params)["data"])
+        
+        try:
+            return await self._run(capture, phase="screenshot")
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Failed to take screenshot: {str(e)}")
+    
+    def _devtools_http(self, path: str, method: str = "GET") -> Any:
+        """Call Chrome's DevTools HTTP endpoint (blocking)"""
+        request = urllib.request.Request(f"http://{self.debugger_address}{path}", method=method)
+        with urllib.request.urlopen(request, timeout=10) as response:
+            body = response.read()
+        try:
+            return json.loads(body)
+        except ValueError:
+            return body.decode(errors="replace")
+    
+    async def open_tab(self) -> Tab:
+        """Open a blank tab in this browser"""
+        self._require_driver()
+        if not self.debugger_address:
+            raise HTTPException(status_code=500, detail="Browser has no DevTools endpoint")
+        loop = asyncio.get_event_loop()
+        # Not on the driver thread: opening a tab shouldn't wait behind the main window's calls
+        target = await loop.run_in_executor(None, self._devtools_http, "/json/new?about:blank", "PUT")
+        tab = Tab(target["id"], target["webSocketDebuggerUrl"], self.metric_labels())
+        try:
+            await tab.connect()
+        except Exception as e:
+            await tab.close()
+            await loop.run_in_executor(None, self._devtools_http, f"/json/close/{tab.tab_id}")
+            raise HTTPException(status_code=500, detail=f"Failed to open tab: {str(e)}")
+        self.tabs[tab.tab_id] = tab
+        return tab
+    
+    def tab(self, tab_id: str) -> Tab:
+        tab = self.tabs.get(tab_id)
+        if tab is not None and tab.closed:
+            del self.tabs[tab_id]
+            tab = None
+        if tab is None:
+            raise HTTPException(status_code=404, detail=f"Tab '{tab_id}' not found")
+        return tab
+    
+    async def close_tab(self, tab_id: str) -> None:
+        tab = self.tab(tab_id)
+        del self.tabs[tab_id]
+        await tab.close()
+        try:
+            loop = asyncio.get_event_loop()
+            await loop.run_in_executor(None, self._devtools_http, f"/json/close/{tab_id}")
+        except Exception:
+            pass  # already gone
+    
+    async def reattach(self, record: Dict[str, Any]) -> None:
+        """Take over a browser recorded by an earlier process (see SessionRegistry)"""
+        if record["proxy"] == PROXY_POOL or "@" in (record["proxy"] or ""):
+            raise RuntimeError("the local proxy relay didn't survive the restart")
+        if not surviving_chrome(record["browser_pid"], record["profile_dir"]):
+            raise RuntimeError("browser is no longer running")
+        
+        def attach():
+            driver_path, _, _ = driver_cache.get()
+            if driver_path is None:
+                raise RuntimeError("reattaching needs the patched driver cache")
+            return ReattachedChrome(record["debugger_address"], record["browser_pid"], driver_path, bool(record["headless"]))
+        
+        self.current_profile = record["profile"]
+        self.user_data_dir = record["profile_dir"] if record["ephemeral"] else None
+        self.template = record["template"]
+        self.tmpfs = bool(record["tmpfs"])
+        self.headless = bool(record["headless"])
+        self.proxy = record["proxy"]
+        reaper.launching += 1
+        try:
+            self.driver = await self._run(attach, phase="launch")
+        finally:
+            reaper.launching -= 1
+        self.block_rules = BlockRules(**json.loads(record["block"])) if record["block"] else None
+        self.created_at = record["created_at"]
+        self.debugger_address = record["debugger_address"]
+        self.reattached = True
+    
+    async def detach_browser(self) -> bool:
+        """
+        Let go of the browser without closing it, so that the next process can
+        reattach to it. Sessions behind a local proxy relay can't outlive this
+        process and are closed instead. Returns whether the browser was kept.
+        """
+        if not self.driver or self.relay or not self.debugger_address:
+            await self.close_browser()
+            return False
+        for tab_id in list(self.tabs):
+            await self.close_tab(tab_id)
+        await self._close_page()
+        driver, self.driver = self.driver, None
+        
+        def release():
+            driver.browser_pid = None  # uc.Chrome's quit() and finalizer would otherwise end Chrome
+            try:
+                driver.service.process.kill()
+            except Exception:
+                pass
+        
+        await self._run(release)
+        self.user_data_dir = None  # still in use by the browser
+        return True
+    
+    async def close_browser(self) -> None:
+        """Close the browser"""
+        await session_registry.remove(self.session_id)
+        tabs, self.tabs = list(self.tabs.values()), {}
+        for tab in tabs:
+            await tab.close()
+        await self._close_page()
+        if self.driver:
+            roots = self.process_roots()
+            driver, self.driver = self.driver, None
+            procs = await self._run(lambda: [proc for pid in roots for proc in process_tree(pid)])
+            try:
+                await self._run(driver.quit, phase="quit")
+            except Exception:
+                pass  # counted in uc_errors_total; the reaper kills whatever quit() left running
+            reaper.expect_exit(self.session_id, procs)
+        if self.relay:
+            relay, self.relay = self.relay, None
+            if relay.upstream is not None:
+                self.proxy_upstream = relay.upstream.server
+            await relay.close()
+        if self.user_data_dir:
+            user_data_dir, self.user_data_dir = self.user_data_dir, None
+            await self._run(functools.partial(shutil.rmtree, user_data_dir, ignore_errors=True))
+            if os.path.exists(user_data_dir):
+                # Chrome may still be writing to it while it shuts down
+                reaper.remove_later(user_data_dir)
+    
+    def rotate_proxy(self) -> str:
+        """Move a proxy pool session to another proxy without restarting the browser"""
+        if self.relay is None or self.proxy != PROXY_POOL:
+            raise HTTPException(status_code=400, detail="Session is not using the proxy pool")
+        upstream = self.relay.rotate()
+        self.proxy_upstream = upstream.server if upstream else None
+        return self.proxy_upstream
+    
+    def shutdown(self) -> None:
+        """Release the worker thread once the session is discarded"""
+        self._executor.shutdown(wait=False)
+    
+    async def get_current_profile(self) -> Optional[str]:
+        """Get the name of the current profile"""
+        return self.current_profile
+    
+    def info(self) -> Dict[str, Any]:
+        """Describe this session for listing endpoints"""
+        return {
+            "session_id": self.session_id,
+            "profile": self.current_profile,
+            "headless": self.headless,
+            "proxy": self.proxy if not self.proxy or "@" not in self.proxy else self.proxy.rsplit("@", 1)[1],
+            "proxy_upstream": self.relay.upstream.server if self.relay and self.relay.upstream else None,
+            "template": self.template,
+            "tmpfs": self.tmpfs,
+            "created_at": self.created_at,
+            "idle_seconds": round(time.monotonic() - self.last_used, 1),
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "pending": self.pending,
+            "age_seconds": round(time.monotonic() - self.launched_at, 1),
+            "navigations": self.navigations,
+            "recycles": self.recycles,
+            "resources": self.resources,
+            "tabs": len(self.tabs),
+            "reattached": self.reattached,
+        }
+
+# Pool of independent browser sessions
+class BrowserPool:
+    """
+    Runs several BrowserController instances side by side, each with its own
+    session ID. Sessions are handed out with profile affinity (a Chrome profile
+    directory can only be opened by one browser at a time), the least recently
+    used idle session is evicted when the pool is full, and sessions idle for
+    longer than idle_timeout are closed as long as min_size sessions remain.
+    
+    Launch options can also be kept warm: for each (headless, proxy, profile)
+    key with a target size, already-launched browsers wait on standby and are
+    claimed by acquire() instead of cold-starting Chrome, then refilled in the
+    background. Standby browsers are not counted against max_size.
+    """
+    def __init__(self, min_size: int = 0, max_size: int = 4, idle_timeout: float = 600.0,
+                 max_rss_mb: float = 0, max_navigations: int = 0, max_age: float = 0,
+                 supervisor_interval: float = 15.0):
+        self.min_size = min_size
+        self.max_size = max(max_size, 1)
+        self.idle_timeout = idle_timeout
+        self.sessions: Dict[str, BrowserController] = {}
+        self.default_session_id: Optional[str] = None
+        self._lock = asyncio.Lock()
+        self._profile_locks: Dict[str, asyncio.Lock] = {}
+        self._launching = 0
+        self._idle_task: Optional[asyncio.Task] = None
+        self.max_rss_mb = max_rss_mb
+        self.max_navigations = max_navigations
+        self.max_age = max_age
+        self.supervisor_interval = supervisor_interval
+        self._supervisor_task: Optional[asyncio.Task] = None
+        self._recycling: Dict[str, asyncio.Task] = {}
+        self.warm_targets: Dict[Tuple[bool, Optional[str], str], int] = {}
+        self.warm: Dict[Tuple[bool, Optional[str], str], List[BrowserController]] = {}
+        self.warm_hits = 0
+        self.warm_misses = 0
+        self._refill_tasks: Dict[Tuple[bool, Optional[str], str], asyncio.Task] = {}
+        self.restored: Dict[str, int] = {"reattached": 0, "reaped": 0}
+        # Sessions taken out of the pool whose browser isn't closed yet; the reaper still counts them
+        self.closing: Dict[str, BrowserController] = {}
+    
+    def _remove(self, session: BrowserController) -> BrowserController:
+        """Take a session out of the pool, to be closed with _discard()"""
+        self.sessions.pop(session.session_id, None)
+        self.closing[session.session_id] = session
+        return session
+    
+    def _find_by_profile(self, profile_name: str) -> Optional[BrowserController]:
+        for session in self.sessions.values():
+            if session.current_profile == profile_name and session.user_data_dir is None:
+                return session
+        return None
+    
+    def free(self) -> int:
+        """Sessions that can still be opened without evicting idle ones"""
+        return max(self.max_size - len(self.sessions) - self._launching, 0)
+    
+    async def acquire(self, profile_name: Optional[str] = "default", headless: bool = False, proxy: Optional[str] = None,
+                      make_default: bool = True, template: Optional[str] = None, tmpfs: bool = False,
+                      evict: bool = True) -> BrowserController:
+        """
+        Return a running session for the profile, launching one if needed.
+        A profile_name of None launches a new session on a throwaway profile,
+        which is cloned from `template` and kept on tmpfs if given. With
+        evict=False a full pool fails with 503 instead of closing idle sessions.
+        """
+        if profile_name is None:
+            return await self._open((headless, proxy, None), [], make_default, template, tmpfs, evict)
+        profile_lock = self._profile_locks.setdefault(profile_name, asyncio.Lock())
+        async with profile_lock:
+            evicted: List[BrowserController] = []
+            async with self._lock:
+                session = self._find_by_profile(profile_name)
+                if session and session.headless == headless and session.proxy == proxy:
+                    session.last_used = time.monotonic()
+                    if make_default:
+                        self.default_session_id = session.session_id
+                    return session
+                if session:
+                    # Same profile with different launch options: it has to be relaunched
+                    evicted.append(self._remove(session))
+            return await self._open((headless, proxy, profile_name), evicted, make_default, evict=evict)
+    
+    async def _open(self, key: Tuple[bool, Optional[str], Optional[str]], evicted: List[BrowserController], make_default: bool,
+                    template: Optional[str] = None, tmpfs: bool = False, evict: bool = True) -> BrowserController:
+        full = False
+        async with self._lock:
+            while len(self.sessions) + self._launching >= self.max_size:
+                idle = [s for s in self.sessions.values() if s.in_flight == 0] if evict else []
+                if not idle:
+                    full = True
+                    break
+                lru = min(idle, key=lambda s: s.last_used)
+                evicted.append(self._remove(lru))
+            if not full:
+                self._launching += 1
+        if full:
+            # A session already taken out for relaunch still has to be closed
+            for old in evicted:
+                await self._discard(old)
+            raise HTTPException(status_code=503, detail=f"Browser pool is full ({self.max_size} sessions)")
+        
+        try:
+            for old in evicted:
+                await self._discard(old)
+            # Standby browsers have empty profiles, so they can't stand in for clones or tmpfs ones
+            controller = None if template or tmpfs else self._claim_warm(key)
+            if controller is None:
+                if key[2] is not None:
+                    await self._discard_standbys(key[2])
+                controller = await self._launch(key, template, tmpfs)
+        finally:
+            async with self._lock:
+                self._launching -= 1
+        async with self._lock:
+            self.sessions[controller.session_id] = controller
+            if make_default:
+                self.default_session_id = controller.session_id
+        await session_registry.save(controller)
+        return controller
+    
+    async def _launch(self, key: Tuple[bool, Optional[str], str], template: Optional[str] = None, tmpfs: bool = False) -> BrowserController:
+        headless, proxy, profile_name = key
+        controller = BrowserController()
+        try:
+            await controller.start_browser(headless=headless, proxy=proxy, profile_name=profile_name, template=template, tmpfs=tmpfs)
+        except Exception:
+            await controller.close_browser()
+            controller.shutdown()
+            raise
+        return controller
+    
+    def _claim_warm(self, key: Tuple[bool, Optional[str], str]) -> Optional[BrowserController]:
+        standby = self.warm.get(key)
+        if standby:
+            self.warm_hits += 1
+            controller = standby.pop(0)
+            controller.last_used = time.monotonic()
+            self._schedule_refill(key)
+            return controller
+        if key in self.warm_targets:
+            self.warm_misses += 1
+        return None
+    
+    async def _discard_standbys(self, profile_name: str) -> None:
+        """Close standby browsers holding a profile that is about to be launched differently"""
+        for key, standby in self.warm.items():
+            if key[2] == profile_name:
+                while standby:
+                    controller = standby.pop()
+                    await controller.close_browser()
+                    controller.shutdown()
+    
+    def _schedule_refill(self, key: Tuple[bool, Optional[str], str]) -> None:
+        task = self._refill_tasks.get(key)
+        if key in self.warm_targets and (task is None or task.done()):
+            self._refill_tasks[key] = asyncio.create_task(self._refill(key))
+    
+    async def _refill(self, key: Tuple[bool, Optional[str], str]) -> None:
+        profile_name = key[2]
+        profile_lock = self._profile_locks.setdefault(profile_name, asyncio.Lock())
+        while len(self.warm.get(key, [])) < self.warm_targets.get(key, 0):
+            async with profile_lock:
+                # A profile folder can only be opened by one Chrome, so a profile
+                # that is in use (or already on standby) can't be warmed again
+                if self._find_by_profile(profile_name) or any(
+                    k[2] == profile_name and standby for k, standby in self.warm.items()
+                ):
+                    return
+                try:
+                    controller = await self._launch(key)
+                except Exception:
+                    return
+                self.warm.setdefault(key, []).append(controller)
+    
+    async def set_warm(self, profile_name: str = "default", headless: bool = False, proxy: Optional[str] = None, size: int = 1) -> None:
+        """Set how many standby browsers to keep for a launch key (0 disables it)"""
+        key = (headless, proxy, profile_name)
+        if size <= 0:
+            self.warm_targets.pop(key, None)
+            for controller in self.warm.pop(key, []):
+                await controller.close_browser()
+                controller.shutdown()
+            return
+        self.warm_targets[key] = size
+        self._schedule_refill(key)
+    
+    def get(self, session_id: Optional[str] = None) -> BrowserController:
+        """Look up a session, falling back to the most recently started one"""
+        if session_id is None:
+            session_id = self.default_session_id
+            if session_id is None:
+                raise HTTPException(status_code=400, detail="Browser not started")
+        session = self.sessions.get(session_id)
+        if session is None:
+            raise HTTPException(status_code=404, detail=f"Session '{session_id}' not found")
+        return session
+    
+    @asynccontextmanager
+    async def checkout(self, session_id: Optional[str] = None):
+        """Hold a session exclusively for the duration of one API call"""
+        session = self.get(session_id)
+        session.in_flight += 1
+        try:
+            async with session.exclusive():
+                if session.driver is None and session.session_id not in self.sessions:
+                    raise HTTPException(status_code=404, detail=f"Session '{session.session_id}' was closed")
+                yield session
+        finally:
+            session.in_flight -= 1
+            session.last_used = time.monotonic()
+            if session.recycle_reason and session.pending == 0:
+                self._schedule_recycle(session)
+    
+    @asynccontextmanager
+    async def checkout_tab(self, session_id: Optional[str], tab_id: str):
+        """Hold one tab for the duration of an API call; other tabs and the main window stay usable"""
+        session = self.get(session_id)
+        tab = session.tab(tab_id)
+        session.in_flight += 1
+        try:
+            async with tab.lock:
+                if tab.closed:
+                    raise HTTPException(status_code=404, detail=f"Tab '{tab_id}' was closed")
+                yield tab
+        finally:
+            session.in_flight -= 1
+            session.last_used = time.monotonic()
+    
+    async def detach(self, session_id: Optional[str] = None) -> BrowserController:
+        """Remove a session from the pool so no new calls can reach it"""
+        async with self._lock:
+            session = self._remove(self.get(session_id))
+            if self.default_session_id == session.session_id:
+                self.default_session_id = None
+        return session
+    
+    async def close(self, session_id: Optional[str] = None) -> None:
+        """Close a session and remove it from the pool"""
+        await self._discard(await self.detach(session_id))
+    
+    async def close_all(self) -> None:
+        async with self._lock:
+            sessions = [self._remove(s) for s in list(self.sessions.values())]
+        for session in sessions:
+            await self._discard(session)
+    
+    async def discard(self, session: BrowserController) -> None:
+        await self._discard(session)
+    
+    async def _discard(self, session: BrowserController) -> None:
+        if self.default_session_id == session.session_id:
+            self.default_session_id = None
+        # Let calls already queued on the session finish before quitting the driver
+        try:
+            async with session.exclusive(force=True):
+                await session.close_browser()
+        finally:
+            # close_browser() has handed its processes to the reaper by now
+            self.closing.pop(session.session_id, None)
+        session.shutdown()
+        # The profile is free again, so standby browsers for it can be relaunched
+        for key in self.warm_targets:
+            if key[2] == session.current_profile:
+                self._schedule_refill(key)
+    
+    async def evict_idle(self) -> None:
+        """Close sessions idle for longer than idle_timeout, keeping at least min_size"""
+        now = time.monotonic()
+        async with self._lock:
+            candidates = sorted(
+                (s for s in self.sessions.values()
+                 if s.in_flight == 0 and now - s.last_used > self.idle_timeout),
+                key=lambda s: s.last_used,
+            )
+            surplus = max(len(self.sessions) - self.min_size, 0)
+            evicted = candidates[:surplus]
+            for session in evicted:
+                self._remove(session)
+        for session in evicted:
+            await self._discard(session)
+    
+    async def _idle_loop(self) -> None:
+        while True:
+            await asyncio.sleep(max(min(self.idle_timeout / 4, 30.0), 1.0))
+            try:
+                await self.evict_idle()
+            except Exception:
+                pass
+    
+    def _recycle_reason(self, session: BrowserController) -> Optional[str]:
+        if self.max_rss_mb and session.resources and session.resources["rss_bytes"] > self.max_rss_mb * 1024 * 1024:
+            return "memory"
+        if self.max_navigations and session.navigations >= self.max_navigations:
+            return "navigations"
+        if self.max_age and time.monotonic() - session.launched_at > self.max_age:
+            return "age"
+        return None
+    
+    def _schedule_recycle(self, session: BrowserController) -> None:
+        task = self._recycling.get(session.session_id)
+        if task is None or task.done():
+            self._recycling[session.session_id] = asyncio.create_task(self._recycle(session))
+    
+    async def _recycle(self, session: BrowserController) -> None:
+        # Holding the session lock makes calls arriving meanwhile wait for the
+        # new browser rather than fail; the supervisor only starts a recycle
+        # when no call is queued, so normally nobody waits at all
+        async with session.exclusive(force=True):
+            reason, session.recycle_reason = session.recycle_reason, None
+            if reason is None or session.driver is None or session.session_id not in self.sessions:
+                return
+            try:
+                await session.recycle()
+                await session_registry.save(session)
+                metrics.recycles.inc(reason=reason)
+            except Exception:
+                # The relaunch failed, so the session is gone
+                self._remove(session)
+                if self.default_session_id == session.session_id:
+                    self.default_session_id = None
+                try:
+                    await session.close_browser()
+                finally:
+                    self.closing.pop(session.session_id, None)
+                session.shutdown()
+    
+    async def supervise(self) -> None:
+        """Sample every session's Chrome processes and recycle the ones over a limit"""
+        loop = asyncio.get_event_loop()
+        for session in list(self.sessions.values()):
+            if session.driver is None:
+                continue
+            await loop.run_in_executor(None, session.sample_resources)
+            reason = self._recycle_reason(session)
+            if reason and not session.recycle_reason:
+                session.recycle_reason = reason
+                # Restart now if the session is idle, otherwise once its last call is done
+                if session.pending == 0:
+                    self._schedule_recycle(session)
+    
+    async def _supervisor_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.supervisor_interval)
+            try:
+                await self.supervise()
+            except Exception:
+                pass
+    
+    async def restore(self) -> Dict[str, int]:
+        """
+        Reattach to the browsers of sessions recorded by an earlier process of
+        this worker, keeping their session IDs, and reap the ones that are gone
+        or can't be reattached
+        """
+        loop = asyncio.get_event_loop()
+        for record in await loop.run_in_executor(None, session_registry.orphaned):
+            controller = BrowserController(record["session_id"])
+            try:
+                await controller.reattach(record)
+            except Exception:
+                controller.shutdown()
+                await loop.run_in_executor(None, reap_browser, record)
+                await session_registry.remove(record["session_id"])
+                self.restored["reaped"] += 1
+                continue
+            self.sessions[controller.session_id] = controller
+            self.default_session_id = controller.session_id
+            await session_registry.save(controller)
+            self.restored["reattached"] += 1
+        return self.restored
+    
+    async def detach_all(self) -> None:
+        """Hand every session over to the next process (see BrowserController.detach_browser)"""
+        async with self._lock:
+            sessions = list(self.sessions.values())
+            self.sessions.clear()
+            self.default_session_id = None
+        for session in sessions:
+            async with session.exclusive(force=True):
+                await session.detach_browser()
+            session.shutdown()
+    
+    def start(self) -> None:
+        # Throwaway profiles of crashed or killed earlier runs are never closed normally
+        sweep_ephemeral_profiles(keep=session_registry.ephemeral_dirs())
+        if self._idle_task is None:
+            self._idle_task = asyncio.create_task(self._idle_loop())
+        if self._supervisor_task is None and self.supervisor_interval > 0:
+            self._supervisor_task = asyncio.create_task(self._supervisor_loop())
+    
+    async def stop(self) -> None:
+        if self._idle_task:
+            self._idle_task.cancel()
+            self._idle_task = None
+        if self._supervisor_task:
+            self._supervisor_task.cancel()
+            self._supervisor_task = None
+        for task in self._recycling.values():
+            task.cancel()
+        self.warm_targets.clear()
+        for task in self._refill_tasks.values():
+            task.cancel()
+        for standby in self.warm.values():
+            for controller in standby:
+                await controller.close_browser()
+                controller.shutdown()
+        self.warm.clear()
+        if PRESERVE_SESSIONS and session_registry.enabled:
+            await self.detach_all()
+        else:
+            await self.close_all()
+    
+    def info(self) -> Dict[str, Any]:
+        return {
+            "min_size": self.min_size,
+            "max_size": self.max_size,
+            "idle_timeout": self.idle_timeout,
+            "default_session_id": self.default_session_id,
+            "restored": self.restored,
+            "sessions": [s.info() for s in self.sessions.values()],
+        }
+    
+    def warm_stats(self) -> Dict[str, Any]:
+        return {
+            "hits": self.warm_hits,
+            "misses": self.warm_misses,
+            "standby": [
+                {
+                    "profile_name": key[2],
+                    "headless": key[0],
+                    "proxy": key[1],
+                    "target": self.warm_targets.get(key, 0),
+                    "ready": len(self.warm.get(key, [])),
+                }
+                for key in set(self.warm_targets) | set(self.warm)
+            ],
+        }
+
+def api_error(e: HTTPException):
+    """
+    Turn an HTTPException into the usual success=false envelope. Back-pressure
+    errors (429/503) also keep their status code and a Retry-After header so
+    clients and proxies know to back off.
+    """
+    if e.status_code in (429, 503):
+        return JSONResponse(
+            status_code=e.status_code,
+            content={"success": False, "data": None, "error": e.detail},
+            headers={"Retry-After": "1"},
+        )
+    return {"success": False, "error": e.detail}
+
+# Response compression for large text bodies
+STREAM_CHUNK_SIZE = 64 * 1024
+
+def choose_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """Pick br or gzip from an Accept-Encoding header, honouring q=0"""
+    accepted = set()
+    for part in (accept_encoding or "").split(","):
+        name, _, params = part.strip().partition(";")
+        q = params.strip()
+        if q.startswith("q="):
+            try:
+                if float(q[2:]) <= 0:
+                    continue
+            except ValueError:
+                continue
+        accepted.add(name.strip().lower())
+    if brotli is not None and "br" in accepted:
+        return "br"
+    if "gzip" in accepted or "*" in accepted:
+        return "gzip"
+    return None
+
+def iter_encoded(text: str, encoding: Optional[str]):
+    """Encode and compress a string chunk by chunk so the whole body is never copied at once"""
+    if encoding == "br":
+        compressor = brotli.Compressor(quality=5)
+        compress, finish = compressor.process, compressor.finish
+    elif encoding == "gzip":
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+        compress, finish = compressor.compress, compressor.flush
+    else:
+        compress = finish = None
+    for start in range(0, len(text), STREAM_CHUNK_SIZE):
+        chunk = text[start:start + STREAM_CHUNK_SIZE].encode("utf-8")
+        chunk = compress(chunk) if compress else chunk
+        if chunk:
+            yield chunk
+    if finish:
+        tail = finish()
+        if tail:
+            yield tail
+
+# Batch fetching
+BATCH_EXTRACTORS = ("title", "html", "js", "screenshot")
+
+def validate_batch(request: BatchFetchRequest) -> None:
+    unknown = [item for item in request.extract if item not in BATCH_EXTRACTORS]
+    if unknown:
+        raise HTTPException(status_code=422, detail=f"Unknown extract option(s): {', '.join(unknown)}")
+    if "js" in request.extract and not request.script:
+        raise HTTPException(status_code=422, detail="A script is required to extract 'js'")
+    if request.order not in ("input", "completion"):
+        raise HTTPException(status_code=422, detail="order must be 'input' or 'completion'")
+    block_patterns(request.block)
+    validate_page_load_strategy(request.page_load_strategy)
+
+class RenderCache:
+    """
+    LRU cache of successful fetch results, keyed by URL, extraction options and
+    profile, so repeat fetches are answered without a browser. Entries live for
+    the TTL and count against a byte budget. When the origin sent an ETag or
+    Last-Modified header with the page the browser loaded, an expired entry is
+    revalidated with a conditional request and kept if the page hasn't changed.
+    """
+    def __init__(self, ttl: float = 0, max_bytes: int = 0):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self.size = 0
+        self.lookups = {"hit": 0, "miss": 0, "revalidated": 0, "bypass": 0}
+        self.evictions = 0
+    
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0 and self.max_bytes > 0
+    
+    @staticmethod
+    def key(url: str, request: BatchFetchRequest, profile: str) -> str:
+        spec = {
+            "url": url,
+            "extract": sorted(request.extract),
+            "script": request.script if "js" in request.extract else None,
+            "strategy": request.page_load_strategy,
+            "wait": request.wait.dict() if request.wait else None,
+            "block": request.block.dict() if request.block else None,
+            "profile": profile,
+        }
+        return hashlib.sha256(json.dumps(spec, sort_keys=True).encode()).hexdigest()
+    
+    @staticmethod
+    def bypass(cache_control: Optional[str]) -> Tuple[bool, bool]:
+        """(skip lookup, skip store) for a request's Cache-Control header"""
+        directives = {d.strip().lower() for d in (cache_control or "").split(",")}
+        if "no-store" in directives:
+            return True, True
+        return "no-cache" in directives, False
+    
+    async def get(self, key: str, proxy: Optional[str] = None) -> Tuple[Optional[Dict[str, Any]], str]:
+        """Return (result, outcome) where outcome is hit, revalidated or miss"""
+        entry = self.entries.get(key)
+        if entry is None:
+            self.lookups["miss"] += 1
+            return None, "miss"
+        if time.time() < entry["expires_at"]:
+            self.entries.move_to_end(key)
+            self.lookups["hit"] += 1
+            return entry["result"], "hit"
+        validators = entry["validators"]
+        if validators:
+            loop = asyncio.get_event_loop()
+            unchanged = await loop.run_in_executor(None, origin_unchanged, entry["result"]["url"], validators, proxy)
+            if unchanged and key in self.entries:
+                entry["expires_at"] = time.time() + self.ttl
+                self.entries.move_to_end(key)
+                self.lookups["revalidated"] += 1
+                return entry["result"], "revalidated"
+        self._remove(key)
+        self.lookups["miss"] += 1
+        return None, "miss"
+    
+    async def lookup(self, url: str, request: BatchFetchRequest, profile: str,
+                     cache_control: Optional[str] = None) -> Tuple[Optional[str], Optional[Dict[str, Any]], str]:
+        """
+        Look a fetch up, honouring the request's Cache-Control header. Returns
+        the key to store a fresh result under (None if it shouldn't be stored),
+        the cached result if there is one, and the outcome.
+        """
+        skip_lookup, skip_store = self.bypass(cache_control)
+        key = self.key(url, request, profile)
+        store_key = None if skip_store else key
+        if skip_lookup:
+            self.lookups["bypass"] += 1
+            return store_key, None, "bypass"
+        started = time.perf_counter()
+        cached, outcome = await self.get(key, request.proxy)
+        if cached is not None:
+            cached = {**cached, "elapsed": round(time.perf_counter() - started, 3), "cache": outcome}
+        return store_key, cached, outcome
+    
+    def store(self, key: Optional[str], result: Dict[str, Any], validators: Optional[Dict[str, str]] = None) -> None:
+        if key is not None and result.get("success"):
+            self.put(key, {k: v for k, v in result.items() if k not in ("elapsed", "cache")}, validators)
+    
+    def put(self, key: str, result: Dict[str, Any], validators: Optional[Dict[str, str]] = None) -> None:
+        size = len(json.dumps(result))
+        if size > self.max_bytes:
+            return
+        self._remove(key)
+        self.entries[key] = {
+            "result": result, "size": size, "expires_at": time.time() + self.ttl, "validators": validators or {},
+        }
+        self.size += size
+        while self.size > self.max_bytes:
+            self._remove(next(iter(self.entries)))
+            self.evictions += 1
+    
+    def _remove(self, key: str) -> None:
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry["size"]
+    
+    def clear(self) -> int:
+        count = len(self.entries)
+        self.entries.clear()
+        self.size = 0
+        return count
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "ttl": self.ttl,
+            "entries": len(self.entries),
+            "bytes": self.size,
+            "max_bytes": self.max_bytes,
+            "lookups": dict(self.lookups),
+            "evictions": self.evictions,
+        }
+
+def _origin_request(url: str, proxy: Optional[str], headers: Dict[str, str]):
+    if proxy == PROXY_POOL:
+        upstream = proxy_pool.choose()
+        proxy = upstream.url() if upstream else None
+    handlers = [urllib.request.ProxyHandler({"http": proxy, "https": proxy})] if proxy else []
+    request = urllib.request.Request(url, method="HEAD", headers=headers)
+    return urllib.request.build_opener(*handlers).open(request, timeout=10)
 
-class JavascriptRequest(BaseModel):
-    script: str
-    timeout: int = 30
+def origin_unchanged(url: str, validators: Dict[str, str], proxy: Optional[str] = None) -> bool:
+    """Conditional HEAD request; True if the origin answers 304 Not Modified"""
+    try:
+        with _origin_request(url, proxy, validators) as response:
+            return response.status == 304
+    except urllib.error.HTTPError as e:
+        return e.code == 304
+    except Exception:
+        return False
 
-class ProfileListResponse(BaseModel):
-    profiles: List[str]
+render_cache = RenderCache(ttl=RENDER_CACHE_TTL, max_bytes=int(RENDER_CACHE_MAX_MB * 1024 * 1024))
 
-class ProxyConfig(BaseModel):
-    server: str
-    username: Optional[str] = None
-    password: Optional[str] = None
+def batch_profile(request: BatchFetchRequest) -> str:
+    """Cache key profile for the throwaway sessions a batch launches"""
+    return json.dumps({"profile": None, "template": request.template, "headless": request.headless, "proxy": request.proxy})
 
-class ApiResponse(BaseModel):
-    success: bool
-    data: Optional[Any] = None
-    error: Optional[str] = None
+async def fetch_page(session: BrowserController, url: str, request: BatchFetchRequest) -> Dict[str, Any]:
+    """Navigate one session to a URL and extract what the batch asked for"""
+    result: Dict[str, Any] = {"url": url, "success": True}
+    started = time.perf_counter()
+    try:
+        if render_cache.enabled:
+            try:
+                await session.track_documents()
+            except HTTPException:
+                pass  # no DevTools connection: cached without validators
+        title = await session.navigate_to(url, request.timeout, request.block, request.page_load_strategy, request.wait)
+        if "title" in request.extract:
+            result["title"] = title
+        if "html" in request.extract:
+            result["html"] = await session.get_html()
+        if "js" in request.extract:
+            result["js"] = await session.execute_js(request.script, request.timeout)
+        if "screenshot" in request.extract:
+            result["screenshot"] = await session.get_screenshot()
+    except HTTPException as e:
+        result.update(success=False, error=e.detail)
+    except Exception as e:
+        result.update(success=False, error=str(e))
+    result["elapsed"] = round(time.perf_counter() - started, 3)
+    return result
 
-# Browser controller class
-class BrowserController:
-    def __init__(self):
-        self.driver: Optional[Any] = None
-        self.current_profile: Optional[str] = None
-        
-    async def start_browser(self, headless: bool = False, proxy: Optional[str] = None, profile_name: str = "default") -> None:
-        """Start a new browser instance with the given options and profile"""
-        # Close any existing session
-        if self.driver:
-            await self.close_browser()
-            
-        options = uc.ChromeOptions()
-        
-        if proxy:
-            options.add_argument(f'--proxy-server={proxy}')
-        
-        # Set up user data directory for the profile
-        profile_path = PROFILES_DIR / profile_name
-        profile_path.mkdir(exist_ok=True)
-        
+async def iter_batch(request: BatchFetchRequest, cache_control: Optional[str] = None, window: int = 0):
+    """
+    Fan the batch's URLs out over several sessions and yield (index, result)
+    pairs as pages finish. Sessions are either the ones listed in the request
+    or new throwaway-profile sessions that are closed afterwards. In the
+    latter case, results in the render cache are yielded first and only the
+    remaining URLs are fetched. With a window, no URL is started more than
+    `window` places after the first one still unfinished, which bounds what a
+    consumer restoring input order has to hold.
+    """
+    urls = [str(url) for url in request.urls]
+    todo = list(enumerate(urls))
+    cache_keys: Dict[int, Tuple[Optional[str], str]] = {}
+    if render_cache.enabled and not request.session_ids:
+        profile = batch_profile(request)
+        lookups = await asyncio.gather(*(render_cache.lookup(url, request, profile, cache_control) for url in urls))
+        todo = []
+        for index, (key, cached, outcome) in enumerate(lookups):
+            if cached is not None:
+                yield index, cached
+            else:
+                cache_keys[index] = (key, outcome)
+                todo.append((index, urls[index]))
+        if not todo:
+            return
+    
+    owned: List[str] = []
+    if request.session_ids:
+        sessions = [pool.get(session_id) for session_id in request.session_ids]
+    else:
+        # Only free slots: throwaway sessions must not evict other clients' idle sessions
+        count = min(max(request.concurrency, 1), len(todo), pool.free())
+        if count < 1:
+            raise HTTPException(status_code=503, detail=f"Browser pool is full ({pool.max_size} sessions)")
+        launched = await asyncio.gather(
+            *(pool.acquire(profile_name=None, headless=request.headless, proxy=request.proxy, make_default=False,
+                           template=request.template, tmpfs=request.tmpfs, evict=False)
+              for _ in range(count)),
+            return_exceptions=True
+        )
+        sessions = [s for s in launched if isinstance(s, BrowserController)]
+        owned = [s.session_id for s in sessions]
+        if not sessions:
+            raise launched[0]
+    
+    pending: asyncio.Queue = asyncio.Queue()
+    for position, (index, url) in enumerate(todo):
+        pending.put_nowait((position, index, url))
+    # Bounded so finished pages wait for the consumer instead of piling up
+    done: asyncio.Queue = asyncio.Queue(maxsize=len(sessions))
+    finished_positions: set = set()
+    first_unfinished = 0
+    progress = asyncio.Condition()
+    
+    async def worker(session: BrowserController) -> None:
+        nonlocal first_unfinished
         try:
-            self.driver = uc.Chrome(
-                headless=headless,
-                options=options,
-                user_data_dir=str(profile_path),
-                use_subprocess=True
-            )
-            self.current_profile = profile_name
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=f"Failed to start browser: {str(e)}")
+            async with pool.checkout(session.session_id):
+                while True:
+                    try:
+                        position, index, url = pending.get_nowait()
+                    except asyncio.QueueEmpty:
+                        break
+                    if window:
+                        # URLs are taken in order, so the first unfinished one is always in progress
+                        async with progress:
+                            await progress.wait_for(lambda: position < first_unfinished + window)
+                    result = await fetch_page(session, url, request)
+                    if index in cache_keys:
+                        key, outcome = cache_keys[index]
+                        render_cache.store(key, result, session.validators)
+                        result["cache"] = outcome
+                    await done.put((index, result))
+                    finished_positions.add(position)
+                    while first_unfinished in finished_positions:
+                        finished_positions.discard(first_unfinished)
+                        first_unfinished += 1
+                    async with progress:
+                        progress.notify_all()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            pass  # the session went away; the other workers pick up its URLs
+        await done.put(None)
     
-    async def navigate_to(self, url: str, timeout: int = 30) -> str:
-        """Navigate to a URL and return the page title"""
-        if not self.driver:
-            raise HTTPException(status_code=400, detail="Browser not started")
-        
+    tasks = [asyncio.create_task(worker(session)) for session in sessions]
+    try:
+        finished = 0
+        while finished < len(tasks):
+            item = await done.get()
+            if item is None:
+                finished += 1
+            else:
+                yield item
+        while not pending.empty():
+            _, index, url = pending.get_nowait()
+            yield index, {"url": url, "success": False, "error": "No browser session available"}
+    finally:
+        for task in tasks:
+            task.cancel()
+        if owned:
+            # Shielded so a cancelled consumer (e.g. a disconnected stream) still closes them
+            await asyncio.shield(asyncio.ensure_future(close_sessions(owned)))
+
+async def close_sessions(session_ids: List[str]) -> None:
+    for session_id in session_ids:
         try:
-            self.driver.set_page_load_timeout(timeout)
-            self.driver.get(url)
-            return self.driver.title
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=f"Navigation failed: {str(e)}")
+            await pool.close(session_id)
+        except HTTPException:
+            pass
+
+async def stream_batch(request: BatchFetchRequest, fmt: str, cache_control: Optional[str] = None):
+    """Encode batch results as NDJSON lines or Server-Sent Events as they arrive"""
+    def encode(event: str, payload: Dict[str, Any]) -> bytes:
+        data = json.dumps(payload)
+        if fmt == "sse":
+            return f"event: {event}\ndata: {data}\n\n".encode()
+        return (data + "\n").encode()
     
-    async def execute_js(self, script: str, timeout: int = 30) -> Any:
-        """Execute JavaScript in the browser and return the result"""
-        if not self.driver:
-            raise HTTPException(status_code=400, detail="Browser not started")
+    started = time.perf_counter()
+    count = 0
+    next_index = 0
+    held: Dict[int, Dict[str, Any]] = {}  # out-of-order results when order == "input"
+    window = max(BATCH_REORDER_WINDOW, 1) if request.order == "input" else 0
+    try:
+        async for index, result in iter_batch(request, cache_control, window):
+            count += 1
+            if request.order == "completion":
+                yield encode("result", {"index": index, **result})
+                continue
+            held[index] = result
+            while next_index in held:
+                yield encode("result", {"index": next_index, **held.pop(next_index)})
+                next_index += 1
+    except HTTPException as e:
+        yield encode("error", {"error": e.detail})
+    except Exception as e:
+        yield encode("error", {"error": str(e)})
+    yield encode("done", {"done": True, "count": count, "elapsed": round(time.perf_counter() - started, 3)})
+
+# Background jobs
+JOB_TYPES = ("navigate", "javascript", "extract")
+
+class Job:
+    def __init__(self, request: JobRequest):
+        self.job_id = uuid.uuid4().hex
+        self.request = request
+        self.status = "queued"  # queued, running, succeeded, failed, cancelled or expired
+        self.result: Any = None
+        self.error: Optional[str] = None
+        self.webhook: Optional[str] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.deadline_at = self.created_at + request.deadline if request.deadline else None
+        self.expiry: Optional[asyncio.TimerHandle] = None  # expires the job if it is still queued at its deadline
+        self.cache_control: Optional[str] = None  # the submitting request's Cache-Control header
+        self.task: Optional[asyncio.Task] = None
+    
+    @property
+    def finished(self) -> bool:
+        return self.status in ("succeeded", "failed", "cancelled", "expired")
+    
+    def info(self) -> Dict[str, Any]:
+        return {
+            "job_id": self.job_id,
+            "type": self.request.type,
+            "status": self.status,
+            "priority": self.request.priority,
+            "result": self.result,
+            "error": self.error,
+            "webhook": self.webhook,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "deadline_at": self.deadline_at,
+        }
+
+class JobManager:
+    """
+    Runs navigate / javascript / extract requests in the background so clients
+    don't hold a connection open for the whole page load. Jobs wait in a
+    priority queue, are abandoned once their deadline passes, can be cancelled,
+    and report their outcome to an optional webhook.
+    """
+    def __init__(self, workers: int = 4, retention: float = 3600.0):
+        self.workers = max(workers, 1)
+        self.retention = retention
+        self.jobs: Dict[str, Job] = {}
+        self._queue: Optional[asyncio.PriorityQueue] = None
+        self._seq = 0
+        self._tasks: List[asyncio.Task] = []
+        self._stopping = False
+    
+    def validate(self, request: JobRequest) -> None:
+        if request.type not in JOB_TYPES:
+            raise HTTPException(status_code=422, detail=f"type must be one of: {', '.join(JOB_TYPES)}")
+        if request.type in ("navigate", "extract") and request.url is None:
+            raise HTTPException(status_code=422, detail=f"A url is required for {request.type} jobs")
+        if request.type == "javascript" and not request.script:
+            raise HTTPException(status_code=422, detail="A script is required for javascript jobs")
+        if request.type == "extract":
+            validate_batch(BatchFetchRequest(urls=[request.url], extract=request.extract, script=request.script))
+    
+    def submit(self, request: JobRequest, cache_control: Optional[str] = None) -> Job:
+        self.validate(request)
+        job = Job(request)
+        job.cache_control = cache_control
+        self.jobs[job.job_id] = job
+        self._seq += 1
+        self._queue.put_nowait((-request.priority, self._seq, job.job_id))
+        if request.deadline:
+            loop = asyncio.get_event_loop()
+            job.expiry = loop.call_at(loop.time() + request.deadline, self._expire, job)
+        return job
+    
+    def _expire(self, job: Job) -> None:
+        if job.status == "queued":
+            job.status = "expired"  # so no worker picks it up in the meantime
+            asyncio.ensure_future(self._finish(job, "expired", error="Deadline passed before the job started"))
+    
+    def get(self, job_id: str) -> Job:
+        job = self.jobs.get(job_id)
+        if job is None:
+            raise HTTPException(status_code=404, detail=f"Job '{job_id}' not found")
+        return job
+    
+    async def cancel(self, job_id: str) -> Job:
+        job = self.get(job_id)
+        if job.status == "queued":
+            await self._finish(job, "cancelled", error="Cancelled before it started")
+        elif job.status == "running" and job.task:
+            job.task.cancel()
+        return job
+    
+    async def _execute(self, job: Job) -> Any:
+        request = job.request
+        if request.type == "extract":
+            batch = BatchFetchRequest(urls=[request.url], extract=request.extract, script=request.script, timeout=request.timeout)
+            if render_cache.enabled:
+                profile = pool.get(request.session_id).current_profile if request.session_id else None
+                profile = profile or batch_profile(batch)
+                key, cached, outcome = await render_cache.lookup(str(request.url), batch, profile, job.cache_control)
+                if cached is not None:
+                    return cached
+                result = await self._extract(request, batch, key)
+                return {**result, "cache": outcome}
+            return await self._extract(request, batch)
+        async with pool.checkout(request.session_id) as session:
+            if request.type == "navigate":
+                return {"title": await session.navigate_to(str(request.url), request.timeout)}
+            return await session.execute_js(request.script, request.timeout)
+    
+    async def _extract(self, request: JobRequest, batch: BatchFetchRequest, cache_key: Optional[str] = None) -> Dict[str, Any]:
+        async def extract(session: BrowserController) -> Dict[str, Any]:
+            result = await fetch_page(session, str(request.url), batch)
+            # Stored while the session still has the page's response headers
+            render_cache.store(cache_key, result, session.validators)
+            return result
         
+        if request.session_id:
+            async with pool.checkout(request.session_id) as session:
+                return await extract(session)
+        session = await pool.acquire(profile_name=None, headless=True, make_default=False, evict=False)
         try:
-            self.driver.set_script_timeout(timeout)
-            result = self.driver.execute_script(f"return {script}")
-            return result
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=f"JavaScript execution failed: {str(e)}")
+            async with pool.checkout(session.session_id):
+                return await extract(session)
+        finally:
+            await asyncio.shield(asyncio.ensure_future(close_sessions([session.session_id])))
     
-    async def get_html(self) -> str:
-        """Get the current page HTML"""
-        if not self.driver:
-            raise HTTPException(status_code=400, detail="Browser not started")
-        
+    async def _run(self, job: Job) -> None:
+        if job.deadline_at and time.time() >= job.deadline_at:
+            await self._finish(job, "expired", error="Deadline passed before the job started")
+            return
+        if job.expiry:
+            job.expiry.cancel()
+        job.status = "running"
+        job.started_at = time.time()
+        job.task = asyncio.ensure_future(self._execute(job))
+        remaining = job.deadline_at - time.time() if job.deadline_at else None
         try:
-            return self.driver.page_source
+            result = await asyncio.wait_for(job.task, remaining)
+        except asyncio.TimeoutError:
+            await self._finish(job, "expired", error="Deadline passed while the job was running")
+        except asyncio.CancelledError:
+            if self._stopping:
+                raise
+            await self._finish(job, "cancelled", error="Cancelled while running")
+        except HTTPException as e:
+            await self._finish(job, "failed", error=e.detail)
         except Exception as e:
-            raise HTTPException(status_code=500, detail=f"Failed to get HTML: {str(e)}")
+            await self._finish(job, "failed", error=str(e))
+        else:
+            if isinstance(result, dict) and result.get("success") is False:
+                await self._finish(job, "failed", result=result, error=result.get("error"))
+            else:
+                await self._finish(job, "succeeded", result=result)
     
-    async def get_screenshot(self) -> str:
-        """Take a screenshot and return as base64 string"""
-        if not self.driver:
-            raise HTTPException(status_code=400, detail="Browser not started")
+    async def _finish(self, job: Job, status: str, result: Any = None, error: Optional[str] = None) -> None:
+        if job.expiry:
+            job.expiry.cancel()
+        job.status = status
+        job.result = result
+        job.error = error
+        job.finished_at = time.time()
+        if job.request.webhook_url:
+            asyncio.ensure_future(self._notify(job))
+    
+    async def _notify(self, job: Job, attempts: int = 3) -> None:
+        """POST the finished job to its webhook, retrying with backoff"""
+        body = json.dumps(job.info()).encode()
         
-        try:
-            screenshot = self.driver.get_screenshot_as_base64()
-            return screenshot
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=f"Failed to take screenshot: {str(e)}")
+        def post():
+            req = urllib.request.Request(str(job.request.webhook_url), data=body, method="POST",
+                                         headers={"Content-Type": "application/json"})
+            with urllib.request.urlopen(req, timeout=10) as response:
+                return response.status
+        
+        loop = asyncio.get_event_loop()
+        for attempt in range(attempts):
+            try:
+                status = await loop.run_in_executor(None, post)
+                job.webhook = f"delivered ({status})"
+                return
+            except Exception as e:
+                job.webhook = f"failed: {e}"
+                await asyncio.sleep(2 ** attempt)
     
-    async def close_browser(self) -> None:
-        """Close the browser"""
-        if self.driver:
+    async def _worker(self) -> None:
+        while True:
+            _, _, job_id = await self._queue.get()
+            job = self.jobs.get(job_id)
+            if job is None or job.status != "queued":
+                continue
             try:
-                self.driver.quit()
-            except Exception:
-                pass
-            finally:
-                self.driver = None
+                await self._run(job)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                await self._finish(job, "failed", error=str(e))
     
-    async def get_current_profile(self) -> Optional[str]:
-        """Get the name of the current profile"""
-        return self.current_profile
+    async def _prune_loop(self) -> None:
+        while True:
+            await asyncio.sleep(60)
+            cutoff = time.time() - self.retention
+            for job_id in [j.job_id for j in self.jobs.values() if j.finished and j.finished_at < cutoff]:
+                self.jobs.pop(job_id, None)
+    
+    def start(self) -> None:
+        if self._queue is None:
+            self._queue = asyncio.PriorityQueue()
+            self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+            self._tasks.append(asyncio.create_task(self._prune_loop()))
+    
+    async def stop(self) -> None:
+        self._stopping = True
+        for job in self.jobs.values():
+            if job.task and not job.task.done():
+                job.task.cancel()
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+        self._queue = None
+    
+    def info(self, status: Optional[str] = None) -> Dict[str, Any]:
+        jobs = [j for j in self.jobs.values() if status is None or j.status == status]
+        return {
+            "queued": sum(1 for j in self.jobs.values() if j.status == "queued"),
+            "running": sum(1 for j in self.jobs.values() if j.status == "running"),
+            "jobs": [
+                {k: v for k, v in j.info().items() if k != "result"}
+                for j in sorted(jobs, key=lambda j: j.created_at)
+            ],
+        }
 
 # FastAPI app
 app = FastAPI(
@@ -140,22 +3312,79 @@ app = FastAPI(
     version="1.0.0"
 )
 
-# Global browser controller
-browser = BrowserController()
+# Global browser pool
+pool = BrowserPool(
+    min_size=POOL_MIN_SIZE,
+    max_size=POOL_MAX_SIZE,
+    idle_timeout=POOL_IDLE_TIMEOUT,
+    max_rss_mb=RECYCLE_MAX_RSS_MB,
+    max_navigations=RECYCLE_MAX_NAVIGATIONS,
+    max_age=RECYCLE_MAX_AGE,
+    supervisor_interval=SUPERVISOR_INTERVAL
+)
+
+# Background job queue
+jobs = JobManager(workers=JOB_WORKERS, retention=JOB_RETENTION)
+
+async def heartbeat_loop() -> None:
+    """Register with the router and keep reporting this worker's capacity and sessions"""
+    loop = asyncio.get_event_loop()
+    while True:
+        body = json.dumps({
+            "url": WORKER_URL,
+            "capacity": pool.max_size,
+            "launching": pool._launching,
+            "sessions": [{"session_id": s.session_id, "profile": s.current_profile} for s in pool.sessions.values()],
+            "standby": pool.warm_stats()["standby"],
+        }).encode()
+        
+        def post():
+            req = urllib.request.Request(f"{ROUTER_URL.rstrip('/')}/router/workers", data=body, method="POST",
+                                         headers={"Content-Type": "application/json"})
+            urllib.request.urlopen(req, timeout=5).close()
+        
+        try:
+            await loop.run_in_executor(None, post)
+        except Exception:
+            pass  # the router may not be up yet, or restarting
+        await asyncio.sleep(HEARTBEAT_INTERVAL)
+
+@app.on_event("startup")
+async def start_pool():
+    await pool.restore()
+    pool.start()
+    jobs.start()
+    reaper.start()
+    if ROUTER_URL and WORKER_URL:
+        app.state.heartbeat = asyncio.create_task(heartbeat_loop())
+
+@app.on_event("shutdown")
+async def stop_pool():
+    heartbeat = getattr(app.state, "heartbeat", None)
+    if heartbeat:
+        heartbeat.cancel()
+    await jobs.stop()
+    await reaper.stop()
+    await pool.stop()
 
 @app.post("/browser/start", response_model=ApiResponse)
 async def start_browser(request: StartBrowserRequest):
     """Start a browser with the specified profile and navigate to the URL"""
     try:
-        await browser.start_browser(
+        session = await pool.acquire(
             headless=request.headless, 
             proxy=request.proxy,
-            profile_name=request.profile_name
+            profile_name=None if request.template else request.profile_name,
+            template=request.template,
+            tmpfs=request.tmpfs
         )
-        title = await browser.navigate_to(str(request.url), 30)  # Use a default timeout for navigation
-        return {"success": True, "data": {"title": title, "profile": request.profile_name}}
+        session.block_rules = request.block
+        await session_registry.save(session)
+        async with pool.checkout(session.session_id):
+            title = await session.navigate_to(str(request.url), 30)  # Use a default timeout for navigation
+        return {"success": True, "data": {"title": title, "profile": session.current_profile, "session_id": session.session_id}}
     except HTTPException as e:
-        return {"success": False, "error": e.detail}
+        return api_error(e)
     except Exception as e:
         return {"success": False, "error": str(e)}
 
@@ -163,10 +3392,21 @@ async def start_browser(request: StartBrowserRequest):
 async def navigate(request: NavigateRequest):
     """Navigate to a URL"""
     try:
-        title = await browser.navigate_to(str(request.url), request.timeout)
+        if request.tab_id:
+            async with pool.checkout_tab(request.session_id, request.tab_id) as tab:
+                rules = request.block if request.block is not None else pool.get(request.session_id).block_rules
+                title = await tab.navigate(
+                    str(request.url), request.timeout, block_patterns(rules), request.page_load_strategy, request.wait,
+                    block_types(rules)
+                )
+            return {"success": True, "data": {"title": title}}
+        async with pool.checkout(request.session_id) as session:
+            title = await session.navigate_to(
+                str(request.url), request.timeout, request.block, request.page_load_strategy, request.wait
+            )
         return {"success": True, "data": {"title": title}}
     except HTTPException as e:
-        return {"success": False, "error": e.detail}
+        return api_error(e)
     except Exception as e:
         return {"success": False, "error": str(e)}
 
@@ -174,50 +3414,306 @@ async def navigate(request: NavigateRequest):
 async def execute_javascript(request: JavascriptRequest):
     """Execute JavaScript on the current page"""
     try:
-        result = await browser.execute_js(request.script, request.timeout)
+        if request.tab_id:
+            async with pool.checkout_tab(request.session_id, request.tab_id) as tab:
+                result = await tab.execute_js(request.script, request.timeout, request.await_promise)
+            return {"success": True, "data": result}
+        async with pool.checkout(request.session_id) as session:
+            result = await session.execute_js(request.script, request.timeout, request.await_promise)
+        return {"success": True, "data": result}
+    except HTTPException as e:
+        return api_error(e)
+    except Exception as e:
+        return {"success": False, "error": str(e)}
+
+@app.post("/browser/javascript/batch", response_model=ApiResponse)
+async def execute_javascript_batch(request: JavascriptBatchRequest):
+    """Evaluate several JavaScript expressions in one round trip and return a result for each"""
+    try:
+        async with pool.checkout(request.session_id) as session:
+            results = await session.execute_js_batch(request.scripts, request.timeout, request.await_promise)
+        return {"success": True, "data": {"results": results}}
+    except HTTPException as e:
+        return api_error(e)
+    except Exception as e:
+        return {"success": False, "error": str(e)}
+
+@app.post("/scripts", response_model=ApiResponse)
+async def register_script(request: ScriptRequest):
+    """Register a JavaScript function once and get a handle to call it by"""
+    try:
+        script = script_registry.register(request.source, request.name)
+        return {"success": True, "data": {"handle": script["handle"], "name": script["name"]}}
+    except Exception as e:
+        return {"success": False, "error": str(e)}
+
+@app.get("/scripts", response_model=ApiResponse)
+async def list_scripts():
+    """List registered scripts"""
+    try:
+        return {"success": True, "data": {"scripts": script_registry.info()}}
+    except Exception as e:
+        return {"success": False, "error": str(e)}
+
+@app.delete("/scripts/{handle}", response_model=ApiResponse)
+async def remove_script(handle: str):
+    """Unregister a script; sessions stop installing it on their next navigation or call"""
+    try:
+        script_registry.remove(handle)
+        return {"success": True, "data": {"handle": handle}}
+    except HTTPException as e:
+        return api_error(e)
+    except Exception as e:
+        return {"success": False, "error": str(e)}
+
+@app.post("/scripts/{handle}/call", response_model=ApiResponse)
+async def call_script(handle: str, request: ScriptCallRequest):
+    """Call a registered script on the current page with the given arguments"""
+    try:
+        async with pool.checkout(request.session_id) as session:
+            result = await session.call_script(handle, request.args, request.timeout)
+        return {"success": True, "data": result}
+    except HTTPException as e:
+        return api_error(e)
+    except Exception as e:
+        return {"success": False, "error": str(e)}
+
+@app.post("/browser/cdp", response_model=ApiResponse)
+async def execute_cdp(request: CdpRequest):
+    """Send a raw Chrome DevTools Protocol command and return its result"""
+    try:
+        async with pool.checkout(request.session_id) as session:
+            result = await session.execute_cdp(request.method, request.params)
         return {"success": True, "data": result}
     except HTTPException as e:
-        return {"success": False, "error": e.detail}
+        return api_error(e)
     except Exception as e:
         return {"success": False, "error": str(e)}
 
+CDP_DEFAULT_EVENTS = "Network,Page,Runtime.consoleAPICalled"
+CDP_ENABLE_ID = 1_000_000_000  # message IDs for our own enable commands, clear of the client's
+
+@app.websocket("/browser/events")
+async def stream_cdp_events(websocket: WebSocket, session_id: Optional[str] = None, tab_id: Optional[str] = None,
+                            events: str = CDP_DEFAULT_EVENTS):
+    """
+    Stream DevTools events from a session's main window, or one of its tabs,
+    over a WebSocket.
+    `events` lists domains ("Network") or event name prefixes
+    ("Runtime.consoleAPICalled"); their domains are enabled automatically.
+    CDP commands sent on the socket are forwarded and answered as well.
+    """
+    await websocket.accept()
+    filters = [event.strip() for event in events.split(",") if event.strip()]
+    try:
+        session = pool.get(session_id)
+        url = session.tab(tab_id).ws_url if tab_id else await session.devtools_url()
+    except HTTPException as e:
+        await websocket.close(code=1008, reason=str(e.detail))
+        return
+    
+    try:
+        # A direct connection to the tab, alongside chromedriver's own
+        async with websockets.connect(url, max_size=None) as devtools:
+            domains = sorted({event.split(".")[0] for event in filters})
+            enabling = set()
+            for offset, domain in enumerate(domains):
+                enabling.add(CDP_ENABLE_ID + offset)
+                await devtools.send(json.dumps({"id": CDP_ENABLE_ID + offset, "method": f"{domain}.enable", "params": {}}))
+            
+            async def relay_events():
+                async for raw in devtools:
+                    message = json.loads(raw)
+                    if "method" in message:
+                        if any(message["method"].startswith(event) for event in filters):
+                            await websocket.send_text(raw)
+                    elif message.get("id") in enabling:
+                        enabling.discard(message["id"])
+                    else:
+                        await websocket.send_text(raw)
+            
+            async def relay_commands():
+                while True:
+                    await devtools.send(await websocket.receive_text())
+            
+            reader = asyncio.ensure_future(relay_events())
+            writer = asyncio.ensure_future(relay_commands())
+            await asyncio.wait([reader, writer], return_when=asyncio.FIRST_COMPLETED)
+            reader.cancel()
+            writer.cancel()
+            if writer.done() and not writer.cancelled():
+                error = writer.exception()
+                if isinstance(error, WebSocketDisconnect):
+                    return  # the client went away
+                raise error
+            if not reader.cancelled() and reader.exception():
+                raise reader.exception()
+        # Chrome closed the connection: the tab or the browser is gone
+        await websocket.close(code=1000, reason="DevTools connection closed")
+    except WebSocketDisconnect:
+        pass
+    except Exception as e:
+        try:
+            await websocket.close(code=1011, reason=str(e)[:120])
+        except Exception:
+            pass
+
 @app.get("/browser/html", response_model=ApiResponse)
-async def get_html():
+async def get_html(session_id: Optional[str] = None, tab_id: Optional[str] = None):
     """Get the HTML of the current page"""
     try:
-        html = await browser.get_html()
+        if tab_id:
+            async with pool.checkout_tab(session_id, tab_id) as tab:
+                return {"success": True, "data": {"html": await tab.get_html()}}
+        async with pool.checkout(session_id) as session:
+            html = await session.get_html()
         return {"success": True, "data": {"html": html}}
     except HTTPException as e:
-        return {"success": False, "error": e.detail}
+        return api_error(e)
     except Exception as e:
         return {"success": False, "error": str(e)}
 
+@app.get("/browser/html/raw")
+async def get_html_raw(session_id: Optional[str] = None, selector: Optional[str] = None, mode: str = "html",
+                       all: bool = False, accept_encoding: Optional[str] = Header(None)):
+    """Stream the page HTML (or a selected subtree / its text) compressed with br or gzip"""
+    try:
+        if mode not in ("html", "text"):
+            raise HTTPException(status_code=422, detail="mode must be 'html' or 'text'")
+        async with pool.checkout(session_id) as session:
+            content = await session.extract_html(selector, mode, all)
+        encoding = choose_encoding(accept_encoding)
+        headers = {"Vary": "Accept-Encoding"}
+        if encoding:
+            headers["Content-Encoding"] = encoding
+        media_type = "text/html; charset=utf-8" if mode == "html" else "text/plain; charset=utf-8"
+        return StreamingResponse(iter_encoded(content, encoding), media_type=media_type, headers=headers)
+    except HTTPException as e:
+        return JSONResponse(status_code=e.status_code, content={"success": False, "data": None, "error": e.detail})
+    except Exception as e:
+        return JSONResponse(status_code=500, content={"success": False, "data": None, "error": str(e)})
+
 @app.get("/browser/screenshot", response_model=ApiResponse)
-async def get_screenshot():
+async def get_screenshot(session_id: Optional[str] = None, tab_id: Optional[str] = None):
     """Take a screenshot of the current page"""
     try:
-        screenshot = await browser.get_screenshot()
+        if tab_id:
+            async with pool.checkout_tab(session_id, tab_id) as tab:
+                return {"success": True, "data": {"screenshot": await tab.get_screenshot()}}
+        async with pool.checkout(session_id) as session:
+            screenshot = await session.get_screenshot()
         return {"success": True, "data": {"screenshot": screenshot}}
     except HTTPException as e:
-        return {"success": False, "error": e.detail}
+        return api_error(e)
+    except Exception as e:
+        return {"success": False, "error": str(e)}
+
+@app.get("/browser/screenshot/image")
+async def get_screenshot_image(session_id: Optional[str] = None, format: str = "png", quality: Optional[int] = None,
+                               scale: float = 1.0, clip: Optional[str] = None, full_page: bool = False):
+    """Take a screenshot and return it as a raw PNG, JPEG or WebP image"""
+    try:
+        if format not in ("png", "jpeg", "webp"):
+            raise HTTPException(status_code=422, detail="format must be 'png', 'jpeg' or 'webp'")
+        if quality is not None and not 0 <= quality <= 100:
+            raise HTTPException(status_code=422, detail="quality must be between 0 and 100")
+        if not 0 < scale <= 4:
+            raise HTTPException(status_code=422, detail="scale must be greater than 0 and at most 4")
+        region = None
+        if clip:
+            try:
+                region = tuple(float(value) for value in clip.split(","))
+            except ValueError:
+                region = ()
+            if len(region) != 4:
+                raise HTTPException(status_code=422, detail="clip must be 'x,y,width,height'")
+        async with pool.checkout(session_id) as session:
+            image = await session.capture_screenshot(format, quality, scale, region, full_page)
+        return Response(content=image, media_type=f"image/{format}")
+    except HTTPException as e:
+        return JSONResponse(status_code=e.status_code, content={"success": False, "data": None, "error": e.detail})
+    except Exception as e:
+        return JSONResponse(status_code=500, content={"success": False, "data": None, "error": str(e)})
+
+@app.post("/browser/tabs", response_model=ApiResponse)
+async def open_tab(request: TabRequest):
+    """Open a tab in a session's browser, optionally navigating it to a URL"""
+    try:
+        validate_page_load_strategy(request.page_load_strategy)
+        session = pool.get(request.session_id)
+        tab = await session.open_tab()
+        data = {"tab_id": tab.tab_id, "session_id": session.session_id}
+        if request.url:
+            async with pool.checkout_tab(session.session_id, tab.tab_id):
+                data["title"] = await tab.navigate(
+                    str(request.url), request.timeout, block_patterns(session.block_rules),
+                    request.page_load_strategy, request.wait, block_types(session.block_rules)
+                )
+        return {"success": True, "data": data}
+    except HTTPException as e:
+        return api_error(e)
+    except Exception as e:
+        return {"success": False, "error": str(e)}
+
+@app.get("/browser/tabs", response_model=ApiResponse)
+async def list_tabs(session_id: Optional[str] = None):
+    """List the tabs opened in a session"""
+    try:
+        session = pool.get(session_id)
+        tabs = [session.tabs[tab_id] for tab_id in list(session.tabs) if not session.tabs[tab_id].closed]
+        return {"success": True, "data": {"tabs": [tab.info() for tab in tabs]}}
+    except HTTPException as e:
+        return api_error(e)
+    except Exception as e:
+        return {"success": False, "error": str(e)}
+
+@app.delete("/browser/tabs/{tab_id}", response_model=ApiResponse)
+async def close_tab(tab_id: str, session_id: Optional[str] = None):
+    """Close a tab"""
+    try:
+        await pool.get(session_id).close_tab(tab_id)
+        return {"success": True, "data": {"tab_id": tab_id}}
+    except HTTPException as e:
+        return api_error(e)
+    except Exception as e:
+        return {"success": False, "error": str(e)}
+
+@app.post("/browser/proxy/rotate", response_model=ApiResponse)
+async def rotate_proxy(session_id: Optional[str] = None):
+    """Move a proxy pool session to the best other proxy, keeping the browser running"""
+    try:
+        proxy = pool.get(session_id).rotate_proxy()
+        return {"success": True, "data": {"proxy": proxy}}
+    except HTTPException as e:
+        return api_error(e)
     except Exception as e:
         return {"success": False, "error": str(e)}
 
 @app.post("/browser/close", response_model=ApiResponse)
-async def close_browser(background_tasks: BackgroundTasks):
+async def close_browser(background_tasks: BackgroundTasks, session_id: Optional[str] = None):
     """Close the browser"""
     try:
-        background_tasks.add_task(browser.close_browser)
-        return {"success": True}
+        # Detach right away so new calls get a 404; calls already queued on
+        # the session finish before the browser is quit in the background
+        session = await pool.detach(session_id)
+        background_tasks.add_task(pool.discard, session)
+        return {"success": True, "data": {"session_id": session.session_id}}
+    except HTTPException as e:
+        return api_error(e)
     except Exception as e:
         return {"success": False, "error": str(e)}
 
 @app.get("/browser/profile", response_model=ApiResponse)
-async def get_current_profile():
+async def get_current_profile(session_id: Optional[str] = None):
     """Get the current browser profile name"""
     try:
-        profile = await browser.get_current_profile()
+        if session_id is None and pool.default_session_id is None:
+            profile = None
+        else:
+            profile = await pool.get(session_id).get_current_profile()
         return {"success": True, "data": {"profile": profile}}
+    except HTTPException as e:
+        return api_error(e)
     except Exception as e:
         return {"success": False, "error": str(e)}
 
@@ -230,17 +3726,208 @@ async def list_profiles():
     except Exception as e:
         return {"success": False, "error": str(e)}
 
+@app.post("/batch/fetch", response_model=ApiResponse)
+async def batch_fetch(request: BatchFetchRequest, cache_control: Optional[str] = Header(None)):
+    """Fetch a list of URLs concurrently across several browser sessions"""
+    try:
+        validate_batch(request)
+        started = time.perf_counter()
+        results: List[Tuple[int, Dict[str, Any]]] = []
+        async for item in iter_batch(request, cache_control):
+            results.append(item)
+        if request.order == "input":
+            results.sort(key=lambda item: item[0])
+        return {"success": True, "data": {
+            "results": [result for _, result in results],
+            "elapsed": round(time.perf_counter() - started, 3),
+        }}
+    except HTTPException as e:
+        return api_error(e)
+    except Exception as e:
+        return {"success": False, "error": str(e)}
+
+@app.post("/batch/fetch/stream")
+async def batch_fetch_stream(request: BatchFetchRequest, format: str = "ndjson", cache_control: Optional[str] = Header(None)):
+    """Fetch a list of URLs and stream each result as soon as its page is done"""
+    if format not in ("ndjson", "sse"):
+        return JSONResponse({"success": False, "data": None, "error": "format must be 'ndjson' or 'sse'"})
+    try:
+        validate_batch(request)
+    except HTTPException as e:
+        return JSONResponse({"success": False, "data": None, "error": e.detail})
+    media_type = "text/event-stream" if format == "sse" else "application/x-ndjson"
+    return StreamingResponse(stream_batch(request, format, cache_control), media_type=media_type)
+
+@app.post("/jobs", response_model=ApiResponse)
+async def submit_job(request: JobRequest, cache_control: Optional[str] = Header(None)):
+    """Queue a navigate, javascript or extract job and return its ID immediately"""
+    try:
+        job = jobs.submit(request, cache_control)
+        return {"success": True, "data": {"job_id": job.job_id, "status": job.status}}
+    except HTTPException as e:
+        return api_error(e)
+    except Exception as e:
+        return {"success": False, "error": str(e)}
+
+@app.get("/jobs", response_model=ApiResponse)
+async def list_jobs(status: Optional[str] = None):
+    """List jobs, optionally filtered by status"""
+    try:
+        return {"success": True, "data": jobs.info(status)}
+    except Exception as e:
+        return {"success": False, "error": str(e)}
+
+@app.get("/jobs/{job_id}", response_model=ApiResponse)
+async def get_job(job_id: str):
+    """Get a job's status and, once finished, its result"""
+    try:
+        return {"success": True, "data": jobs.get(job_id).info()}
+    except HTTPException as e:
+        return api_error(e)
+    except Exception as e:
+        return {"success": False, "error": str(e)}
+
+@app.delete("/jobs/{job_id}", response_model=ApiResponse)
+async def cancel_job(job_id: str):
+    """Cancel a queued or running job"""
+    try:
+        job = await jobs.cancel(job_id)
+        return {"success": True, "data": {"job_id": job.job_id, "status": job.status}}
+    except HTTPException as e:
+        return api_error(e)
+    except Exception as e:
+        return {"success": False, "error": str(e)}
+
+@app.post("/pool/warm", response_model=ApiResponse)
+async def set_warm_pool(request: WarmPoolRequest):
+    """Keep browsers launched on standby for the given options (size 0 disables)"""
+    try:
+        await pool.set_warm(
+            profile_name=request.profile_name,
+            headless=request.headless,
+            proxy=request.proxy,
+            size=request.size
+        )
+        return {"success": True, "data": pool.warm_stats()}
+    except Exception as e:
+        return {"success": False, "error": str(e)}
+
+@app.post("/proxies", response_model=ApiResponse)
+async def add_proxies(request: ProxyPoolRequest):
+    """Add upstream proxies to the proxy pool (existing ones get their credentials updated)"""
+    try:
+        for config in request.proxies:
+            proxy_pool.add(UpstreamProxy(config.server, config.username, config.password))
+        return {"success": True, "data": {"proxies": proxy_pool.info()}}
+    except HTTPException as e:
+        return api_error(e)
+    except Exception as e:
+        return {"success": False, "error": str(e)}
+
+@app.get("/proxies", response_model=ApiResponse)
+async def list_proxies():
+    """Report each pool proxy's health, latency and failure rate, best first"""
+    try:
+        return {"success": True, "data": {"proxies": proxy_pool.info()}}
+    except Exception as e:
+        return {"success": False, "error": str(e)}
+
+@app.delete("/proxies", response_model=ApiResponse)
+async def remove_proxy(server: str):
+    """Remove a proxy from the pool; sessions using it move to another on their next connection"""
+    try:
+        proxy_pool.remove(server)
+        return {"success": True, "data": {"proxies": proxy_pool.info()}}
+    except HTTPException as e:
+        return api_error(e)
+    except Exception as e:
+        return {"success": False, "error": str(e)}
+
+@app.get("/pool/stats", response_model=ApiResponse)
+async def get_pool_stats():
+    """Report warm standby hit/miss counts and readiness"""
+    try:
+        return {"success": True, "data": pool.warm_stats()}
+    except Exception as e:
+        return {"success": False, "error": str(e)}
+
+@app.get("/reaper", response_model=ApiResponse)
+async def get_reaper():
+    """Report leaked Chrome and chromedriver processes the reaper has killed"""
+    try:
+        return {"success": True, "data": reaper.info()}
+    except Exception as e:
+        return {"success": False, "error": str(e)}
+
+@app.get("/driver/cache", response_model=ApiResponse)
+async def get_driver_cache_stats():
+    """Report patched chromedriver cache hits and launch times"""
+    try:
+        return {"success": True, "data": driver_cache.stats()}
+    except Exception as e:
+        return {"success": False, "error": str(e)}
+
+@app.get("/cache", response_model=ApiResponse)
+async def get_render_cache_stats():
+    """Report rendered-result cache size and hit/miss counts"""
+    try:
+        return {"success": True, "data": render_cache.stats()}
+    except Exception as e:
+        return {"success": False, "error": str(e)}
+
+@app.delete("/cache", response_model=ApiResponse)
+async def clear_render_cache():
+    """Drop every entry from the rendered-result cache"""
+    try:
+        return {"success": True, "data": {"cleared": render_cache.clear()}}
+    except Exception as e:
+        return {"success": False, "error": str(e)}
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Prometheus metrics: phase latencies, errors, pool occupancy, queue depth and Chrome memory"""
+    sessions = list(pool.sessions.values())
+    loop = asyncio.get_event_loop()
+    # Walking the Chrome process trees blocks, so it runs off the event loop
+    rss = await loop.run_in_executor(None, lambda: {s.session_id: s.process_rss() for s in sessions})
+    return PlainTextResponse(metrics.render(rss), media_type="text/plain; version=0.0.4")
+
+@app.get("/sessions", response_model=ApiResponse)
+async def list_sessions():
+    """List the running browser sessions in the pool"""
+    try:
+        return {"success": True, "data": pool.info()}
+    except Exception as e:
+        return {"success": False, "error": str(e)}
+
 if __name__ == "__main__":
+    import argparse
     import uvicorn
     import sys
     
+    parser = argparse.ArgumentParser(description="Stealth Browser API server")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--router", default=ROUTER_URL, help="router URL to register with as a worker")
+    parser.add_argument("--worker-url", default=WORKER_URL,
+                        help="URL the router uses to reach this worker (default: http://127.0.0.1:<port>)")
+    args = parser.parse_args()
+    ROUTER_URL = args.router
+    WORKER_URL = args.worker_url
+    if not WORKER_URL:
+        if ROUTER_URL and urllib.parse.urlparse(ROUTER_URL).hostname not in ("127.0.0.1", "localhost", "::1"):
+            # The default address would point a remote router back at itself
+            parser.error("--worker-url (or UC_WORKER_URL) is required with a router on another host")
+        # Also keeps the session registries of workers on different ports apart
+        WORKER_URL = f"http://127.0.0.1:{args.port}"
+    
     # Check if port is already in use before starting
     sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     try:
-        sock.bind(("0.0.0.0", 8000))
+        sock.bind((args.host, args.port))
         sock.close()
         # Port is available, start the server
-        uvicorn.run(app, host="0.0.0.0", port=8000)
+        uvicorn.run(app, host=args.host, port=args.port)
     except socket.error as e:
-        print(f"Port 8000 is already in use. Server may already be running.")
+        print(f"Port {args.port} is already in use. Server may already be running.")
         sys.exit(0)  # Exit gracefully without error code
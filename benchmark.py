@@ -0,0 +1,395 @@
+import argparse
+import asyncio
+import base64
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from typing import Dict, Optional, Any, List
+
+import httpx
+import psutil
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+ENDPOINTS = ("navigate", "javascript", "html", "screenshot", "batch", "session")
+
+# Seconds the stub driver spends in each call, overridable with --latency
+STUB_LATENCY = {"launch": 0.3, "navigate": 0.05, "script": 0.002, "page_source": 0.005, "screenshot": 0.03, "quit": 0.05}
+
+def fixture_page(path: str, size_kb: int = 64) -> str:
+    """A deterministic HTML page of roughly size_kb for a fixture path"""
+    paragraph = f"<p>Fixture content for {path}. " + "Lorem ipsum dolor sit amet, consectetur adipiscing elit. " * 8 + "</p>\n"
+    body = paragraph * max(1, size_kb * 1024 // len(paragraph))
+    return f"<!DOCTYPE html><html><head><title>Fixture {path}</title></head><body><h1>{path}</h1>\n{body}</body></html>"
+
+def start_fixture_server(size_kb: int) -> ThreadingHTTPServer:
+    """Serve fixture pages on a free local port, so runs against real Chrome need no network"""
+    class FixtureHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = fixture_page(self.path, size_kb).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FixtureHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+class StubChrome:
+    """
+    Stand-in for uc.Chrome that never starts a browser. get, execute_script,
+    page_source and get_screenshot_as_base64 (and the CDP commands the API
+    sends) sleep for the configured latency and return fixture content, so
+    what is measured is the API's own overhead.
+    """
+    latency: Dict[str, float] = dict(STUB_LATENCY)
+    jitter: float = 0.0
+    page_kb: int = 64
+
+    def __init__(self, headless: bool = False, options: Any = None, user_data_dir: Optional[str] = None, **kwargs):
+        self._sleep("launch")
+        self.options = SimpleNamespace(debugger_address=None)
+        self.browser_pid = None
+        self.service = None
+        self.current_url = "about:blank"
+        self.title = ""
+        self.current_window_handle = "stub"
+        self._scripts = 0
+
+    def _sleep(self, call: str) -> None:
+        delay = self.latency.get(call, 0.0)
+        if delay > 0:
+            time.sleep(delay * random.uniform(1 - self.jitter, 1 + self.jitter))
+
+    def _load(self, url: str) -> None:
+        self._sleep("navigate")
+        self.current_url = url
+        self.title = f"Fixture {url.split('/', 3)[-1] if url.count('/') >= 3 else url}"
+
+    def set_page_load_timeout(self, timeout: float) -> None:
+        pass
+
+    def set_script_timeout(self, timeout: float) -> None:
+        pass
+
+    def get(self, url: str) -> None:
+        self._load(url)
+
+    @property
+    def page_source(self) -> str:
+        self._sleep("page_source")
+        return fixture_page(self.current_url, self.page_kb)
+
+    def execute_script(self, script: str, *args: Any) -> Any:
+        self._sleep("script")
+        if "transferSize" in script:
+            return self.page_kb * 1024
+        if "getEntriesByType('resource').length" in script:
+            return [True, 1]  # wait conditions
+        if "innerWidth" in script:
+            return [1280, 800]
+        if "arguments[0]" in script and args:
+            return f"<div>{args[0]}</div>"
+        return self.title
+
+    def execute_async_script(self, script: str, *args: Any) -> Any:
+        self._sleep("script")
+        return []
+
+    def get_screenshot_as_base64(self) -> str:
+        self._sleep("screenshot")
+        return base64.b64encode(b"\x89PNG\r\n\x1a\n" + b"\0" * 32 * 1024).decode()
+
+    def execute_cdp_cmd(self, cmd: str, params: Dict[str, Any]) -> Dict[str, Any]:
+        if cmd == "Page.navigate":
+            self._load(params["url"])
+            return {"frameId": "stub"}
+        if cmd == "Page.captureScreenshot":
+            return {"data": self.get_screenshot_as_base64()}
+        if cmd == "Page.addScriptToEvaluateOnNewDocument":
+            self._scripts += 1
+            return {"identifier": str(self._scripts)}
+        return {}
+
+    def quit(self) -> None:
+        self._sleep("quit")
+
+def serve(args: argparse.Namespace) -> None:
+    """Run the API in this process, on the stub driver unless the backend is real Chrome"""
+    import uvicorn
+    sys.path.insert(0, APP_DIR)
+    import app
+
+    if args.backend == "stub":
+        StubChrome.latency.update(parse_latency(args.latency))
+        StubChrome.jitter = args.jitter
+        StubChrome.page_kb = args.page_kb
+        app.uc.Chrome = StubChrome
+        app.driver_cache.root = None  # nothing to patch
+    uvicorn.run(app.app, host="127.0.0.1", port=args.port, log_level="warning")
+
+def parse_latency(spec: str) -> Dict[str, float]:
+    latency = {}
+    for item in filter(None, spec.split(",")):
+        call, _, seconds = item.partition("=")
+        if call not in STUB_LATENCY:
+            raise SystemExit(f"Unknown stub call '{call}' (expected one of: {', '.join(STUB_LATENCY)})")
+        latency[call] = float(seconds)
+    return latency
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+def tree_rss(pid: int) -> int:
+    """Resident memory of the API process and everything it started (Chrome included)"""
+    try:
+        root = psutil.Process(pid)
+        procs = [root] + root.children(recursive=True)
+    except psutil.Error:
+        return 0
+    total = 0
+    for proc in procs:
+        try:
+            total += proc.memory_info().rss
+        except psutil.Error:
+            pass
+    return total
+
+class Benchmark:
+    """Drives one endpoint at a time against the API at each concurrency level"""
+    def __init__(self, client: httpx.AsyncClient, fixture_url: str, server_pid: int, headless: bool):
+        self.client = client
+        self.fixture_url = fixture_url
+        self.server_pid = server_pid
+        self.headless = headless
+        self.sessions: List[str] = []
+        self._pages = 0
+
+    def _url(self) -> str:
+        self._pages += 1
+        return f"{self.fixture_url}/page/{self._pages % 50}"
+
+    async def _call(self, method: str, path: str, **kwargs) -> Dict[str, Any]:
+        response = await self.client.request(method, path, **kwargs)
+        payload = response.json()
+        if not payload.get("success"):
+            raise RuntimeError(payload.get("error") or f"HTTP {response.status_code}")
+        return payload["data"]
+
+    async def start_session(self) -> str:
+        data = await self._call("POST", "/browser/start", json={
+            "url": self._url(), "profile_name": None, "headless": self.headless,
+        })
+        return data["session_id"]
+
+    async def open_sessions(self, count: int) -> None:
+        while len(self.sessions) < count:
+            self.sessions.append(await self.start_session())
+
+    async def close_sessions(self) -> None:
+        for session_id in self.sessions:
+            try:
+                await self._call("POST", "/browser/close", params={"session_id": session_id})
+            except Exception:
+                pass
+        self.sessions = []
+
+    async def request(self, endpoint: str, session_id: str) -> None:
+        if endpoint == "navigate":
+            await self._call("POST", "/browser/navigate", json={"url": self._url(), "session_id": session_id})
+        elif endpoint == "javascript":
+            await self._call("POST", "/browser/javascript", json={"script": "document.title", "session_id": session_id})
+        elif endpoint == "html":
+            await self._call("GET", "/browser/html", params={"session_id": session_id})
+        elif endpoint == "screenshot":
+            await self._call("GET", "/browser/screenshot", params={"session_id": session_id})
+        elif endpoint == "batch":
+            result = await self._call("POST", "/batch/fetch", json={
+                "urls": [self._url() for _ in range(5)], "session_ids": [session_id], "concurrency": 1,
+            })
+            failed = [r for r in result["results"] if not r["success"]]
+            if failed:
+                raise RuntimeError(failed[0]["error"])
+        elif endpoint == "session":
+            session_id = await self.start_session()
+            await self._call("POST", "/browser/close", params={"session_id": session_id})
+
+    async def run(self, endpoint: str, concurrency: int, requests: int) -> Dict[str, Any]:
+        """Send `requests` calls with `concurrency` in flight, one session per concurrent caller"""
+        await self.open_sessions(concurrency)
+        latencies: List[float] = []
+        errors: List[str] = []
+        remaining = requests
+        peak_rss = tree_rss(self.server_pid)
+        baseline_rss = peak_rss
+
+        async def caller(session_id: str):
+            nonlocal remaining
+            while remaining > 0:
+                remaining -= 1
+                started = time.perf_counter()
+                try:
+                    await self.request(endpoint, session_id)
+                    latencies.append(time.perf_counter() - started)
+                except Exception as e:
+                    errors.append(str(e))
+
+        async def sample_memory():
+            nonlocal peak_rss
+            loop = asyncio.get_event_loop()
+            while True:
+                peak_rss = max(peak_rss, await loop.run_in_executor(None, tree_rss, self.server_pid))
+                await asyncio.sleep(0.05)
+
+        sampler = asyncio.ensure_future(sample_memory())
+        started = time.perf_counter()
+        await asyncio.gather(*(caller(session_id) for session_id in self.sessions[:concurrency]))
+        elapsed = time.perf_counter() - started
+        sampler.cancel()
+        return {
+            "endpoint": endpoint,
+            "concurrency": concurrency,
+            "requests": requests,
+            "errors": len(errors),
+            "first_error": errors[0] if errors else None,
+            "throughput": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+            "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+            "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+            "rss_mb": round(peak_rss / 2 ** 20, 1),
+            "rss_growth_mb": round((peak_rss - baseline_rss) / 2 ** 20, 1),
+        }
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+async def run_benchmarks(args: argparse.Namespace) -> List[Dict[str, Any]]:
+    levels = [int(level) for level in args.concurrency.split(",")]
+    endpoints = args.endpoints.split(",")
+    unknown = [e for e in endpoints if e not in ENDPOINTS]
+    if unknown:
+        raise SystemExit(f"Unknown endpoint(s): {', '.join(unknown)} (expected: {', '.join(ENDPOINTS)})")
+
+    fixtures = start_fixture_server(args.page_kb)
+    port = free_port()
+    env = {
+        **os.environ,
+        "UC_SESSION_DB": "",  # don't leave sessions behind for the next real start
+        # Room for one session per caller, plus the ones the "session" endpoint starts
+        "UC_POOL_MAX_SIZE": str(2 * max(levels)),
+        "UC_SESSION_QUEUE_DEPTH": str(max(levels) * 4),
+    }
+    command = [sys.executable, os.path.abspath(__file__), "--serve", "--port", str(port), "--backend", args.backend,
+               "--latency", args.latency, "--jitter", str(args.jitter), "--page-kb", str(args.page_kb)]
+    server = subprocess.Popen(command, env=env)
+    results = []
+    try:
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=120,
+                                     limits=httpx.Limits(max_connections=2 * max(levels))) as client:
+            deadline = time.monotonic() + 60
+            while True:
+                try:
+                    await client.get("/pool/stats")
+                    break
+                except httpx.TransportError:
+                    if server.poll() is not None or time.monotonic() > deadline:
+                        raise SystemExit("The API server didn't start")
+                    await asyncio.sleep(0.2)
+
+            bench = Benchmark(client, f"http://127.0.0.1:{fixtures.server_port}", server.pid, headless=args.backend == "chrome")
+            for endpoint in endpoints:
+                for concurrency in levels:
+                    if args.warmup:
+                        await bench.run(endpoint, concurrency, args.warmup)
+                    result = await bench.run(endpoint, concurrency, args.requests)
+                    results.append(result)
+                    print_row(result)
+            await bench.close_sessions()
+    finally:
+        server.terminate()
+        try:
+            server.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            server.kill()
+        fixtures.shutdown()
+    return results
+
+COLUMNS = (("endpoint", 11), ("concurrency", 11), ("throughput", 11), ("p50_ms", 9), ("p99_ms", 9),
+           ("rss_mb", 8), ("rss_growth_mb", 13), ("errors", 6))
+
+def print_header() -> None:
+    print("  ".join(name.rjust(width) for name, width in COLUMNS))
+
+def print_row(result: Dict[str, Any]) -> None:
+    print("  ".join(str(result[name]).rjust(width) for name, width in COLUMNS), flush=True)
+    if result["first_error"]:
+        print(f"    first error: {result['first_error']}", flush=True)
+
+def compare(results: List[Dict[str, Any]], baseline: List[Dict[str, Any]], tolerance: float) -> List[str]:
+    """Describe every result whose throughput or median latency is worse than the baseline by more than tolerance"""
+    previous = {(r["endpoint"], r["concurrency"]): r for r in baseline}
+    regressions = []
+    for result in results:
+        before = previous.get((result["endpoint"], result["concurrency"]))
+        if before is None:
+            continue
+        label = f"{result['endpoint']} @ {result['concurrency']}"
+        if before["throughput"] and result["throughput"] < before["throughput"] * (1 - tolerance):
+            regressions.append(f"{label}: throughput {before['throughput']} -> {result['throughput']} req/s")
+        if before["p50_ms"] and result["p50_ms"] > before["p50_ms"] * (1 + tolerance):
+            regressions.append(f"{label}: p50 {before['p50_ms']} -> {result['p50_ms']} ms")
+        if result["errors"] > before["errors"]:
+            regressions.append(f"{label}: {before['errors']} -> {result['errors']} errors")
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load-test the Stealth Browser API against a stub driver or real Chrome")
+    parser.add_argument("--backend", choices=("stub", "chrome"), default="stub",
+                        help="stub: fake WebDriver with fixed latencies; chrome: real browsers loading local fixture pages")
+    parser.add_argument("--endpoints", default=",".join(ENDPOINTS), help=f"comma-separated, any of: {', '.join(ENDPOINTS)}")
+    parser.add_argument("--concurrency", default="1,4,16", help="comma-separated concurrency levels")
+    parser.add_argument("--requests", type=int, default=200, help="requests per endpoint and concurrency level")
+    parser.add_argument("--warmup", type=int, default=10, help="unmeasured requests before each level")
+    parser.add_argument("--latency", default="", help="stub call latencies in seconds, e.g. navigate=0.1,script=0.01")
+    parser.add_argument("--jitter", type=float, default=0.0, help="random +/- fraction applied to stub latencies")
+    parser.add_argument("--page-kb", type=int, default=64, help="size of the fixture pages")
+    parser.add_argument("--save", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="compare with results saved earlier and exit 1 on a regression")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed slowdown against the baseline (0.2 = 20%%)")
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, default=8000, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args)
+        sys.exit(0)
+
+    print(f"backend={args.backend} requests={args.requests} concurrency={args.concurrency}")
+    print_header()
+    results = asyncio.run(run_benchmarks(args))
+
+    if args.save:
+        with open(args.save, "w") as fh:
+            json.dump({"backend": args.backend, "created_at": time.time(), "results": results}, fh, indent=2)
+    if args.baseline:
+        with open(args.baseline) as fh:
+            regressions = compare(results, json.load(fh)["results"], args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        sys.exit(1 if regressions else 0)
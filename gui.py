@@ -2,7 +2,6 @@ import tkinter as tk
 from tkinter import ttk, scrolledtext, messagebox, simpledialog
 import requests
 import json
-import base64
 from PIL import Image, ImageTk
 import io
 import threading
@@ -600,7 +599,7 @@ class BrowserControllerGUI:
         self.status_var.set("Taking screenshot...")
         
         # Show request details immediately
-        endpoint = f"{self.api_url}/browser/screenshot"
+        endpoint = f"{self.api_url}/browser/screenshot/image"
         request_info = f"GET {endpoint}"
         self.screenshot_request.delete(1.0, tk.END)
         self.screenshot_request.insert(tk.END, request_info)
@@ -613,60 +612,58 @@ class BrowserControllerGUI:
         def send_request():
             try:
                 response = requests.get(endpoint)
-                data = response.json()
-                self.root.after(0, lambda: self._update_screenshot_response(data))
+                if response.headers.get("content-type", "").startswith("image/"):
+                    screenshot_bytes = response.content
+                    self.root.after(0, lambda: self._update_screenshot_response(screenshot_bytes))
+                else:
+                    error_msg = response.json().get('error', 'Unknown error')
+                    self.root.after(0, lambda: self._update_screenshot_error(error_msg))
             except Exception as e:
                 error_msg = str(e)
                 self.root.after(0, lambda: self._update_screenshot_error(error_msg))
         
         threading.Thread(target=send_request).start()
     
-    def _update_screenshot_response(self, data):
-        """Update screenshot display with server response"""
-        if data.get("success"):
-            screenshot_base64 = data.get('data', {}).get('screenshot', '')
-            if screenshot_base64:
-                # Store the screenshot data
-                self.current_screenshot = screenshot_base64
-                
-                # Convert base64 to image
-                screenshot_bytes = base64.b64decode(screenshot_base64)
-                image = Image.open(io.BytesIO(screenshot_bytes))
-                
-                # Resize to fit the frame
-                frame_width = self.screenshot_frame.winfo_width()
-                frame_height = self.screenshot_frame.winfo_height()
-                
-                # Ensure we have valid dimensions
-                if frame_width <= 1:
-                    frame_width = 800
-                if frame_height <= 1:
-                    frame_height = 600
-                
-                # Calculate scaling ratio
-                img_width, img_height = image.size
-                ratio = min(frame_width / img_width, frame_height / img_height)
-                new_width = int(img_width * ratio)
-                new_height = int(img_height * ratio)
-                
-                # Resize image
-                resized_image = image.resize((new_width, new_height), Image.LANCZOS)
-                
-                # Convert to PhotoImage
-                tk_image = ImageTk.PhotoImage(resized_image)
-                
-                # Update label
-                self.screenshot_label.config(image=tk_image)
-                self.screenshot_label.image = tk_image  # Keep a reference
-                
-                # Enable save button
-                self.save_screenshot_button.config(state=tk.NORMAL)
-                
-                self.status_var.set(f"Screenshot taken successfully")
-            else:
-                self.status_var.set("Error: No screenshot data received")
+    def _update_screenshot_response(self, screenshot_bytes):
+        """Update screenshot display with the PNG returned by the server"""
+        if screenshot_bytes:
+            # Store the screenshot data
+            self.current_screenshot = screenshot_bytes
+            
+            image = Image.open(io.BytesIO(screenshot_bytes))
+            
+            # Resize to fit the frame
+            frame_width = self.screenshot_frame.winfo_width()
+            frame_height = self.screenshot_frame.winfo_height()
+            
+            # Ensure we have valid dimensions
+            if frame_width <= 1:
+                frame_width = 800
+            if frame_height <= 1:
+                frame_height = 600
+            
+            # Calculate scaling ratio
+            img_width, img_height = image.size
+            ratio = min(frame_width / img_width, frame_height / img_height)
+            new_width = int(img_width * ratio)
+            new_height = int(img_height * ratio)
+            
+            # Resize image
+            resized_image = image.resize((new_width, new_height), Image.LANCZOS)
+            
+            # Convert to PhotoImage
+            tk_image = ImageTk.PhotoImage(resized_image)
+            
+            # Update label
+            self.screenshot_label.config(image=tk_image)
+            self.screenshot_label.image = tk_image  # Keep a reference
+            
+            # Enable save button
+            self.save_screenshot_button.config(state=tk.NORMAL)
+            
+            self.status_var.set(f"Screenshot taken successfully")
         else:
-            self.status_var.set(f"Error: {data.get('error', 'Unknown error')}")
+            self.status_var.set("Error: No screenshot data received")
     
     def _update_screenshot_error(self, error_msg):
         """Update screenshot status with error message"""
@@ -687,9 +684,7 @@ class BrowserControllerGUI:
         
         if file_path:
             try:
-                # Convert base64 to image and save
-                screenshot_bytes = base64.b64decode(self.current_screenshot)
-                image = Image.open(io.BytesIO(screenshot_bytes))
+                image = Image.open(io.BytesIO(self.current_screenshot))
                 image.save(file_path)
                 self.status_var.set(f"Screenshot saved to {file_path}")
             except Exception as e:
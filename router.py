@@ -0,0 +1,467 @@
+import argparse
+import asyncio
+import atexit
+import json
+import os
+import subprocess
+import sys
+import time
+from typing import Dict, Optional, Any, List, Tuple
+
+import httpx
+import websockets
+from fastapi import FastAPI, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+from pydantic import BaseModel
+from starlette.background import BackgroundTask
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+
+# Workers that haven't reported in for this long get no new sessions
+HEARTBEAT_TIMEOUT = float(os.environ.get("UC_ROUTER_HEARTBEAT_TIMEOUT", "15"))
+
+# Headers that describe one hop and must not be forwarded
+HOP_HEADERS = {"connection", "keep-alive", "transfer-encoding", "te", "upgrade", "host", "content-length",
+               "proxy-authorization", "proxy-connection", "trailer"}
+
+# Endpoints whose state has to be the same on every worker
+BROADCAST_PATHS = ("scripts", "proxies", "cache")
+
+class WorkerRegistration(BaseModel):
+    url: str
+    capacity: int
+    launching: int = 0
+    sessions: List[Dict[str, Any]] = []  # {"session_id": ..., "profile": ...}
+    standby: List[Dict[str, Any]] = []  # warm pool entries, as in the worker's GET /pool/stats
+
+class Worker:
+    def __init__(self, url: str):
+        self.url = url.rstrip("/")
+        self.capacity = 1
+        self.launching = 0
+        self.sessions: Dict[str, Optional[str]] = {}  # session ID -> profile, as last reported
+        self.standby: List[Dict[str, Any]] = []  # warm pool entries, as last reported
+        self.placed = 0  # sessions sent here since the last heartbeat
+        self.last_seen = 0.0
+
+    @property
+    def alive(self) -> bool:
+        return time.monotonic() - self.last_seen < HEARTBEAT_TIMEOUT
+
+    def load(self) -> float:
+        return (len(self.sessions) + self.launching + self.placed) / max(self.capacity, 1)
+
+    def holds(self, profile: str) -> bool:
+        """Whether the profile folder is in use here, by a session or by standby browsers"""
+        if profile in self.sessions.values():
+            return True
+        return any(s["profile_name"] == profile and (s.get("target") or s.get("ready")) for s in self.standby)
+
+    def info(self) -> Dict[str, Any]:
+        return {
+            "url": self.url,
+            "alive": self.alive,
+            "capacity": self.capacity,
+            "sessions": len(self.sessions),
+            "launching": self.launching,
+            "standby": sum(s.get("ready", 0) for s in self.standby),
+            "load": round(self.load(), 3),
+            "last_seen_seconds": round(time.monotonic() - self.last_seen, 1),
+        }
+
+class Router:
+    """
+    Tracks the workers and which one owns each session and job. New sessions
+    go to the least-loaded live worker (or the one already holding their
+    profile, in a session or warm on standby), and every later call for a
+    session goes to its owner.
+    """
+    def __init__(self):
+        self.workers: Dict[str, Worker] = {}
+        self.owners: Dict[str, Tuple[str, float]] = {}  # session ID -> (worker URL, when it was recorded)
+        self.jobs: Dict[str, str] = {}  # job ID -> worker URL
+        self.default_session_id: Optional[str] = None
+
+    def register(self, registration: WorkerRegistration) -> Worker:
+        worker = self.workers.setdefault(registration.url.rstrip("/"), Worker(registration.url))
+        worker.capacity = registration.capacity
+        worker.launching = registration.launching
+        worker.sessions = {s["session_id"]: s.get("profile") for s in registration.sessions}
+        worker.standby = registration.standby
+        worker.placed = 0
+        worker.last_seen = time.monotonic()
+        now = time.monotonic()
+        # The worker's report is authoritative, except for sessions placed after it was sent
+        for session_id, (url, since) in list(self.owners.items()):
+            if url == worker.url and session_id not in worker.sessions and now - since > HEARTBEAT_TIMEOUT:
+                self.forget(session_id)
+        for session_id in worker.sessions:
+            if self.owners.get(session_id, (None,))[0] != worker.url:
+                self.owners[session_id] = (worker.url, now)
+        return worker
+
+    def alive(self) -> List[Worker]:
+        return [w for w in self.workers.values() if w.alive]
+
+    def holder(self, profile: str) -> Optional[Worker]:
+        for worker in self.alive():
+            if worker.holds(profile):
+                return worker
+        return None
+
+    def least_loaded(self) -> Worker:
+        workers = self.alive()
+        if not workers:
+            raise RoutingError(503, "No workers available")
+        return min(workers, key=lambda w: w.load())
+
+    def place(self, profile: Optional[str] = None) -> Worker:
+        if profile:
+            # A profile folder can only be open in one Chrome, so keep it on one worker.
+            # That is also where its standby browsers are.
+            worker = self.holder(profile)
+            if worker is not None:
+                return worker
+        worker = self.least_loaded()
+        worker.placed += 1
+        return worker
+
+    def owner(self, session_id: Optional[str]) -> Worker:
+        session_id = session_id or self.default_session_id
+        if session_id is None:
+            raise RoutingError(400, "Browser not started")
+        url = self.owners.get(session_id, (None,))[0]
+        if url is None:
+            raise RoutingError(404, f"Session '{session_id}' not found")
+        worker = self.workers[url]
+        if not worker.alive:
+            raise RoutingError(503, f"Worker {url} owning session '{session_id}' is not responding")
+        return worker
+
+    def record(self, session_id: str, worker: Worker, make_default: bool = True) -> None:
+        self.owners[session_id] = (worker.url, time.monotonic())
+        if make_default:
+            self.default_session_id = session_id
+
+    def forget(self, session_id: str) -> None:
+        self.owners.pop(session_id, None)
+        if self.default_session_id == session_id:
+            self.default_session_id = None
+
+class RoutingError(Exception):
+    def __init__(self, status_code: int, detail: str):
+        self.status_code = status_code
+        self.detail = detail
+
+def routing_error(e: RoutingError) -> JSONResponse:
+    # Same convention as the workers: only "retry later" errors change the status code
+    status_code = e.status_code if e.status_code in (429, 503) else 200
+    headers = {"Retry-After": "1"} if status_code == 503 else None
+    return JSONResponse(status_code=status_code, headers=headers,
+                        content={"success": False, "data": None, "error": e.detail})
+
+router = Router()
+client = httpx.AsyncClient(timeout=httpx.Timeout(None, connect=5.0))
+
+app = FastAPI(
+    title="Stealth Browser API Router",
+    description="Routes Stealth Browser API calls to the worker that owns each session",
+    version="1.0.0"
+)
+
+async def forward(worker: Worker, request: Request, body: bytes, inspect: bool = False):
+    """
+    Send the request on to a worker. The response is streamed back as is, or
+    read in full with its JSON payload returned as well when inspect is set.
+    """
+    url = worker.url + request.url.path + (f"?{request.url.query}" if request.url.query else "")
+    headers = {k: v for k, v in request.headers.items() if k.lower() not in HOP_HEADERS}
+    try:
+        upstream = await client.send(client.build_request(request.method, url, headers=headers, content=body), stream=True)
+    except httpx.HTTPError as e:
+        raise RoutingError(503, f"Worker {worker.url} is unavailable: {e}")
+    response_headers = {k: v for k, v in upstream.headers.items() if k.lower() not in HOP_HEADERS}
+    if not inspect:
+        return StreamingResponse(upstream.aiter_raw(), status_code=upstream.status_code, headers=response_headers,
+                                 background=BackgroundTask(upstream.aclose)), None
+    content = await upstream.aread()
+    await upstream.aclose()
+    try:
+        payload = json.loads(content)
+    except ValueError:
+        payload = None
+    return Response(content=content, status_code=upstream.status_code, headers=response_headers), payload
+
+async def fetch_all(path: str, query: str = "", raw: bool = False) -> List[Tuple[Worker, Any]]:
+    """GET a JSON endpoint (or with raw, any text) from every live worker"""
+    workers = router.alive()
+
+    async def fetch(worker: Worker):
+        response = await client.get(worker.url + path + (f"?{query}" if query else ""))
+        return worker, response.text if raw else response.json()
+
+    results = await asyncio.gather(*(fetch(w) for w in workers), return_exceptions=True)
+    return [r for r in results if not isinstance(r, Exception)]
+
+async def per_worker(path: str) -> Dict[str, Any]:
+    """A worker-local stats endpoint from every live worker, each tagged with its worker"""
+    return {"success": True, "data": {
+        "workers": [{"worker": worker.url, **(payload.get("data") or {})} for worker, payload in await fetch_all(path)],
+    }, "error": None}
+
+def merge_metrics(texts: List[Tuple[Worker, str]]) -> str:
+    """
+    Combine the workers' Prometheus exposition into one, adding a worker label
+    to every sample and keeping each metric's samples together under a single
+    HELP and TYPE.
+    """
+    families: Dict[str, Tuple[Dict[str, str], List[str]]] = {}
+    for worker, text in texts:
+        label = f'worker="{worker.url}"'
+        family = None
+        for line in text.splitlines():
+            if line.startswith("# "):
+                parts = line.split(" ", 3)
+                if len(parts) >= 3:
+                    family = parts[2]
+                    families.setdefault(family, ({}, []))[0].setdefault(parts[1], line)
+                continue
+            if not line.strip():
+                continue
+            brace, space = line.find("{"), line.find(" ")
+            if brace != -1 and brace < space:
+                line = line[:brace + 1] + label + ("" if line[brace + 1] == "}" else ",") + line[brace + 1:]
+            else:
+                line = line[:space] + "{" + label + "}" + line[space:]
+            families.setdefault(family or line[:line.find("{")], ({}, []))[1].append(line)
+    lines = []
+    for headers, samples in families.values():
+        lines += list(headers.values()) + samples
+    return "\n".join(lines) + "\n"
+
+@app.post("/router/workers")
+async def register_worker(registration: WorkerRegistration):
+    """Heartbeat from a worker: its capacity and the sessions it holds"""
+    worker = router.register(registration)
+    return {"success": True, "data": worker.info(), "error": None}
+
+@app.get("/router/workers")
+async def list_workers():
+    """List the registered workers and their load"""
+    return {"success": True, "data": {
+        "workers": [w.info() for w in router.workers.values()],
+        "sessions": len(router.owners),
+        "default_session_id": router.default_session_id,
+    }, "error": None}
+
+@app.get("/sessions")
+async def list_sessions():
+    """Sessions across all workers, each tagged with its worker"""
+    sessions = []
+    for worker, payload in await fetch_all("/sessions"):
+        for session in (payload.get("data") or {}).get("sessions", []):
+            sessions.append({**session, "worker": worker.url})
+    return {"success": True, "data": {
+        "workers": len(router.alive()),
+        "default_session_id": router.default_session_id,
+        "sessions": sessions,
+    }, "error": None}
+
+@app.get("/jobs")
+async def list_jobs(request: Request):
+    """Jobs across all workers"""
+    merged = {"queued": 0, "running": 0, "jobs": []}
+    for worker, payload in await fetch_all("/jobs", request.url.query):
+        data = payload.get("data") or {}
+        merged["queued"] += data.get("queued", 0)
+        merged["running"] += data.get("running", 0)
+        merged["jobs"] += [{**job, "worker": worker.url} for job in data.get("jobs", [])]
+    merged["jobs"].sort(key=lambda job: job["created_at"])
+    return {"success": True, "data": merged, "error": None}
+
+@app.get("/pool/stats")
+async def pool_stats():
+    """Warm standby counts across all workers"""
+    merged = {"hits": 0, "misses": 0, "standby": []}
+    for worker, payload in await fetch_all("/pool/stats"):
+        data = payload.get("data") or {}
+        merged["hits"] += data.get("hits", 0)
+        merged["misses"] += data.get("misses", 0)
+        merged["standby"] += [{**entry, "worker": worker.url} for entry in data.get("standby", [])]
+    return {"success": True, "data": merged, "error": None}
+
+@app.get("/reaper")
+async def reaper_stats():
+    """Each worker's leaked process reaper"""
+    return await per_worker("/reaper")
+
+@app.get("/driver/cache")
+async def driver_cache_stats():
+    """Each worker's patched chromedriver cache"""
+    return await per_worker("/driver/cache")
+
+@app.get("/cache")
+async def render_cache_stats():
+    """Each worker's rendered-result cache"""
+    return await per_worker("/cache")
+
+@app.get("/metrics")
+async def metrics():
+    """Every worker's Prometheus metrics, labelled by worker"""
+    return PlainTextResponse(merge_metrics(await fetch_all("/metrics", raw=True)),
+                             media_type="text/plain; version=0.0.4")
+
+@app.websocket("/browser/events")
+async def relay_events(websocket: WebSocket):
+    """Relay a session's DevTools event stream from its worker"""
+    await websocket.accept()
+    try:
+        worker = router.owner(websocket.query_params.get("session_id"))
+    except RoutingError as e:
+        await websocket.close(code=1008, reason=e.detail)
+        return
+    url = "ws" + worker.url[len("http"):] + "/browser/events" + (f"?{websocket.url.query}" if websocket.url.query else "")
+    try:
+        async with websockets.connect(url, max_size=None) as upstream:
+            async def downstream():
+                async for message in upstream:
+                    await websocket.send_text(message if isinstance(message, str) else message.decode())
+
+            async def upstream_commands():
+                while True:
+                    await upstream.send(await websocket.receive_text())
+
+            reader = asyncio.ensure_future(downstream())
+            writer = asyncio.ensure_future(upstream_commands())
+            await asyncio.wait([reader, writer], return_when=asyncio.FIRST_COMPLETED)
+            reader.cancel()
+            writer.cancel()
+            if writer.done() and not writer.cancelled() and isinstance(writer.exception(), WebSocketDisconnect):
+                return
+        await websocket.close(code=upstream.close_code or 1000, reason=upstream.close_reason or "")
+    except WebSocketDisconnect:
+        pass
+    except Exception as e:
+        try:
+            await websocket.close(code=1011, reason=str(e)[:120])
+        except Exception:
+            pass
+
+@app.api_route("/{path:path}", methods=["GET", "POST", "PUT", "DELETE"])
+async def route(path: str, request: Request):
+    """Forward any other call to the worker that should handle it"""
+    body = await request.body()
+    payload: Dict[str, Any] = {}
+    if body and "json" in request.headers.get("content-type", ""):
+        try:
+            payload = json.loads(body)
+        except ValueError:
+            pass
+        if not isinstance(payload, dict):
+            payload = {}
+    session_id = request.query_params.get("session_id") or payload.get("session_id")
+
+    try:
+        if path == "browser/start":
+            worker = router.place(None if payload.get("template") else payload.get("profile_name", "default"))
+            response, result = await forward(worker, request, body, inspect=True)
+            if result and result.get("success"):
+                router.record(result["data"]["session_id"], worker)
+            return response
+
+        if path == "browser/close":
+            response, result = await forward(router.owner(session_id), request, body, inspect=True)
+            if result and result.get("success"):
+                router.forget(result["data"]["session_id"])
+            return response
+
+        if path in ("batch/fetch", "batch/fetch/stream"):
+            session_ids = payload.get("session_ids") or []
+            owners = {router.owner(sid).url for sid in session_ids}
+            if len(owners) > 1:
+                raise RoutingError(400, "All sessions in a batch must be on the same worker")
+            worker = router.owner(session_ids[0]) if session_ids else router.place()
+            return (await forward(worker, request, body))[0]
+
+        if path == "pool/warm" and request.method == "POST":
+            # Standby browsers hold their profile folder, so only one worker may warm it
+            profile = payload.get("profile_name", "default")
+            worker = router.holder(profile) or router.least_loaded()
+            response, result = await forward(worker, request, body, inspect=True)
+            if result and result.get("success"):
+                worker.standby = result["data"]["standby"]
+            return response
+
+        if path == "jobs" and request.method == "POST":
+            # Only extract jobs can run without a session; the others use the default one
+            if session_id or payload.get("type") != "extract":
+                worker = router.owner(session_id)
+            else:
+                worker = router.place()
+            response, result = await forward(worker, request, body, inspect=True)
+            if result and result.get("success"):
+                router.jobs[result["data"]["job_id"]] = worker.url
+            return response
+
+        if path.startswith("jobs/"):
+            url = router.jobs.get(path.split("/", 1)[1])
+            if url is None or not router.workers[url].alive:
+                raise RoutingError(404, f"Job '{path.split('/', 1)[1]}' not found")
+            return (await forward(router.workers[url], request, body))[0]
+
+        if path == "browser/profiles":
+            return (await forward(router.place(), request, body))[0]
+
+        if path.startswith("browser/") or (path.startswith("scripts/") and path.endswith("/call")):
+            return (await forward(router.owner(session_id), request, body))[0]
+
+        if request.method != "GET" and any(path == p or path.startswith(p + "/") for p in BROADCAST_PATHS):
+            workers = router.alive()
+            if not workers:
+                raise RoutingError(503, "No workers available")
+            results = await asyncio.gather(*(forward(w, request, body, inspect=True) for w in workers))
+            failed = [(response, result) for response, result in results if not (result and result.get("success"))]
+            return (failed or results)[0][0]
+
+        # Everything else reads state that every worker has, so any of them will do
+        return (await forward(router.least_loaded(), request, body))[0]
+    except RoutingError as e:
+        return routing_error(e)
+
+@app.on_event("shutdown")
+async def close_client():
+    await client.aclose()
+
+def spawn_workers(count: int, base_port: int, router_url: str) -> List[subprocess.Popen]:
+    """Start app.py workers on consecutive ports that register with this router"""
+    workers = []
+    for port in range(base_port, base_port + count):
+        env = {**os.environ, "UC_ROUTER_URL": router_url, "UC_WORKER_URL": f"http://127.0.0.1:{port}"}
+        workers.append(subprocess.Popen(
+            [sys.executable, APP_PATH, "--host", "127.0.0.1", "--port", str(port)], env=env
+        ))
+    return workers
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Session-aware router for Stealth Browser API workers")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=0, help="number of local app.py workers to start")
+    parser.add_argument("--worker-port", type=int, default=None, help="port of the first local worker (default: port + 1)")
+    args = parser.parse_args()
+
+    children = spawn_workers(args.workers, args.worker_port or args.port + 1, f"http://127.0.0.1:{args.port}")
+
+    @atexit.register
+    def stop_workers():
+        for child in children:
+            child.terminate()
+        for child in children:
+            try:
+                child.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                child.kill()
+
+    uvicorn.run(app, host=args.host, port=args.port)